@@ -1,2 +1,2 @@
-VERSION = (2, 3, 10)
+VERSION = (2, 4, 0)
 __version__ = '.'.join(map(str, VERSION))
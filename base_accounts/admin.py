@@ -0,0 +1,45 @@
+from django.conf.urls import patterns, url
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+
+from base_accounts import bulk, session_index
+
+
+def revoke_sessions(modeladmin, request, queryset):
+    """Admin action logging selected users out of all their sessions"""
+    revoked = sum(session_index.revoke_sessions(user) for user in queryset.only('pk'))
+    messages.success(request, _('%d sessions revoked') % revoked)
+revoke_sessions.short_description = _('Log out of all sessions')
+
+
+class ExportUsersMixin(object):
+    """
+    User admin mixin adding an ``export/`` view that streams users as CSV or
+    JSON lines to admins allowed to change users
+    """
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return patterns(
+            '',
+            url(r'^export/$', self.admin_site.admin_view(self.export_view), name='%s_%s_export' % info),
+        ) + super(ExportUsersMixin, self).get_urls()
+
+    def export_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        fmt = 'jsonl' if request.GET.get('format') == 'jsonl' else 'csv'
+        compress = bool(request.GET.get('gzip'))
+        booleans = {'yes': True, 'no': False}
+        chunks = bulk.export_users(
+            fmt=fmt,
+            confirmed=booleans.get(request.GET.get('confirmed')),
+            is_active=booleans.get(request.GET.get('active')),
+            compress=compress,
+        )
+        filename = 'users.%s%s' % (fmt, '.gz' if compress else '')
+        response = StreamingHttpResponse(chunks, content_type='application/gzip' if compress else 'text/%s' % fmt)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
@@ -1,14 +1,103 @@
+from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
 
+from base_accounts import auth_cache, db, email_filter, hashing, rehash
+from base_accounts.instrumentation import Timer
+from base_accounts.utils import email_lookup, normalize_email
+
 
 class EmailBackend(ModelBackend):
 
     def authenticate(self, email=None, password=None):
+        if email is None:
+            return None
+        timer = Timer('authenticate')
+        user_model = get_user_model()
+        email = normalize_email(email)
+
+        # Skip lookup for emails certainly not in use
+        known = email_filter.might_contain(email)
+        if known is False and email_filter.trusted():
+            timer.phase('lookup', 'miss')
+            return self.reject_unknown(password)
+
+        # Get password hash from cache, or from the user row on a miss
+        user = None
+        cached = auth_cache.get_credentials(email)
+        if cached is None:
+            try:
+                user = db.detach(db.for_read(user_model).get(email_lookup(email)))
+            except (user_model.DoesNotExist, user_model.MultipleObjectsReturned):
+                email_filter.record_lookup(email, known, False)
+                timer.phase('lookup', 'miss')
+                return self.reject_unknown(password)
+            email_filter.record_lookup(email, known, True)
+            if db.read_alias() is None:  # Replica rows may hold a hash changed since
+                auth_cache.set_credentials(user)
+            pk, encoded = user.pk, user.password
+            timer.phase('lookup', 'hit')
+        else:
+            pk, encoded = cached
+            timer.phase('lookup', 'cached')
+
+        valid, must_update = hashing.check_password(password, encoded)
+        if not valid:
+            timer.phase('hash', 'bad_password')
+            return None
+        timer.phase('hash')
+
+        # A cache hit still needs the user instance to log in
+        if user is None:
+            try:
+                user = db.detach(db.for_read(user_model).get(pk=pk, normalized_email=email))
+            except user_model.DoesNotExist:
+                auth_cache.invalidate(email)
+                return None
+            if user.password != encoded:  # Stale entry, check current hash
+                auth_cache.invalidate(email)
+                valid, must_update = hashing.check_password(password, user.password)
+                if not valid:
+                    timer.phase('fetch', 'bad_password')
+                    return None
+            timer.phase('fetch')
+
+        # Upgrade hash when the hasher or its settings have changed
+        if must_update:
+            if rehash.enabled():
+                rehash.schedule(user, password)
+            else:
+                user.password = hashing.make_password(password)
+                user.save(update_fields=['password'])
+            timer.phase('rehash')
+
+        timer.phase('result', 'success' if user.is_active else 'inactive')
+        return user
+
+    def get_user(self, user_id):
+        """
+        Load the session user, optionally restricted to the fields in
+        ``BASE_ACCOUNTS_USER_ONLY_FIELDS`` or without the ones in
+        ``BASE_ACCOUNTS_USER_DEFER_FIELDS``
+        """
         user_model = get_user_model()
+        queryset = user_model._default_manager.all()
+        only_fields = getattr(settings, 'BASE_ACCOUNTS_USER_ONLY_FIELDS', None)
+        defer_fields = getattr(settings, 'BASE_ACCOUNTS_USER_DEFER_FIELDS', None)
+        if only_fields:
+            queryset = queryset.only(*only_fields)
+        elif defer_fields:
+            queryset = queryset.defer(*defer_fields)
         try:
-            user = user_model.objects.get(email__iexact=email.lower())
-            if user.check_password(password):
-                return user
+            return queryset.get(pk=user_id)
         except user_model.DoesNotExist:
             return None
+
+    def reject_unknown(self, password):
+        """
+        Optionally spend a hash on unknown emails, so they take as long to
+        reject as a wrong password and do not reveal which accounts exist
+        """
+        if getattr(settings, 'BASE_ACCOUNTS_HASH_UNKNOWN_EMAILS', False):
+            hashing.make_password(password, getattr(settings, 'BASE_ACCOUNTS_DUMMY_HASHER', 'default'))
+        return None
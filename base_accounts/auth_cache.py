@@ -0,0 +1,47 @@
+"""
+Opt-in cache of login credentials, keyed by normalized email.
+
+Maps an email to the user primary key and password hash, so that logins
+with a wrong password are rejected by ``EmailBackend`` without reading the
+user row. Entries are dropped when ``BaseUser.save`` may change the password
+or email, and when a login finds the cached hash stale.
+"""
+import hashlib
+
+from django.conf import settings
+
+from base_accounts.utils import get_cache
+
+
+def _enabled():
+    return getattr(settings, 'BASE_ACCOUNTS_AUTH_CACHE', False)
+
+
+def _cache():
+    return get_cache(getattr(settings, 'BASE_ACCOUNTS_AUTH_CACHE_ALIAS', 'default'))
+
+
+def _key(email):
+    return 'base_accounts:auth:%s' % hashlib.sha1(email.encode('utf-8')).hexdigest()
+
+
+def get_credentials(email):
+    """
+    Return cached ``(pk, password)`` for a normalized email, or None
+    """
+    if not _enabled() or not email:
+        return None
+    return _cache().get(_key(email))
+
+
+def set_credentials(user):
+    if not _enabled() or not user.normalized_email:
+        return
+    timeout = getattr(settings, 'BASE_ACCOUNTS_AUTH_CACHE_TIMEOUT', 300)
+    _cache().set(_key(user.normalized_email), (user.pk, user.password), timeout)
+
+
+def invalidate(email):
+    if not _enabled() or not email:
+        return
+    _cache().delete(_key(email))
@@ -0,0 +1,118 @@
+"""
+Fixed size renditions of ``BaseUser.image``.
+
+Renditions are stored next to the original image, named after it plus size
+and format (``photo.png`` gives ``photo_48.webp``, ``photo_48.jpg``...), so
+their URLs can be computed without touching the database or the storage.
+They are generated in a background thread pool when a new image is saved,
+if ``BASE_ACCOUNTS_AVATAR_RENDITIONS`` is enabled, and by the
+``generate_avatar_renditions`` command for existing images.
+"""
+import logging
+import os
+import threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+_lock = threading.Lock()
+_pool = None
+_scheduled = set()
+
+
+def enabled():
+    return getattr(settings, 'BASE_ACCOUNTS_AVATAR_RENDITIONS', False)
+
+
+def get_sizes():
+    return getattr(settings, 'BASE_ACCOUNTS_AVATAR_SIZES', (48, 96, 256))
+
+
+def get_formats():
+    return getattr(settings, 'BASE_ACCOUNTS_AVATAR_FORMATS', ('WEBP', 'JPEG'))
+
+
+def rendition_name(image_name, size, image_format='JPEG'):
+    root, ext = os.path.splitext(image_name)
+    return '%s_%d.%s' % (root, size, EXTENSIONS[image_format])
+
+
+def rendition_url(image_name, size, image_format='JPEG', storage=None):
+    return (storage or default_storage).url(rendition_name(image_name, size, image_format))
+
+
+def generate_renditions(image_name, storage=None, overwrite=False):
+    """
+    Create the missing renditions of ``image_name`` (all of them if
+    ``overwrite``) and return how many were written
+    """
+    storage = storage or default_storage
+    wanted = [
+        (size, image_format) for size in sorted(get_sizes(), reverse=True) for image_format in get_formats()
+        if overwrite or not storage.exists(rendition_name(image_name, size, image_format))
+    ]
+    if not wanted:
+        return 0
+
+    largest = wanted[0][0]
+    with storage.open(image_name, 'rb') as f:
+        image = Image.open(f)
+        image.draft('RGB', (largest, largest))  # Let JPEG decode at a reduced scale
+        image = image.convert('RGB')
+
+    # Crop to a centered square
+    width, height = image.size
+    side = min(width, height)
+    left, top = (width - side) // 2, (height - side) // 2
+    image = image.crop((left, top, left + side, top + side))
+
+    # Resize from the largest size down, reusing each result
+    resample = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+    written = 0
+    for size, image_format in wanted:
+        if image.size[0] > size:
+            image = image.resize((size, size), resample)
+        buf = BytesIO()
+        image.save(buf, image_format, quality=85)
+        name = rendition_name(image_name, size, image_format)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(buf.getvalue()))
+        written += 1
+    return written
+
+
+def _generate(image_name):
+    try:
+        generate_renditions(image_name)
+    except Exception:
+        logger.exception("Could not generate renditions of %s", image_name)
+    finally:
+        with _lock:
+            _scheduled.discard(image_name)
+
+
+def schedule(image_name):
+    """
+    Generate renditions of ``image_name`` in the background pool
+    """
+    global _pool
+    with _lock:
+        if image_name in _scheduled:
+            return
+        _scheduled.add(image_name)
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'BASE_ACCOUNTS_AVATAR_WORKERS', 2))
+    _pool.apply_async(_generate, (image_name,))
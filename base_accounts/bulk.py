@@ -0,0 +1,226 @@
+import csv
+import json
+import operator
+import time
+import zlib
+from functools import reduce
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.template.defaultfilters import slugify
+from django.utils import six
+
+from base_accounts import db, email_filter
+from base_accounts.utils import chunked_queryset, normalize_email, get_username_allocator, unnormalized_emails_exist
+
+EXPORT_FIELDS = ('email', 'name', 'slug', 'confirmed', 'date_joined')
+
+
+class _Echo(object):
+    """File-like object handing back what ``csv.writer`` writes"""
+
+    def write(self, value):
+        return value
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _save_one(user, base_user, allocate, max_attempts):
+    """
+    Insert a single user, retrying with new usernames on collisions.
+    Returns False if the email has been taken meanwhile.
+    """
+    for attempt in range(max_attempts):
+        try:
+            with transaction.atomic():
+                user.save()
+            return True
+        except IntegrityError:
+            if not base_user.objects.filter(Q(username=user.username) | Q(slug=user.slug)).exists():
+                return False
+            user.username = allocate(user.email, attempt + 1)
+            user.slug = ''  # Recomputed by ``BaseUser.save``
+    return False
+
+
+def bulk_create_email_users(rows, user_model=None, batch_size=1000, workers=None, prehashed=False):
+    """
+    Create users from an iterable of dicts holding ``email``, ``password``
+    and any other ``user_model`` fields, as ``create_email_user`` would but
+    in batches. Rows are consumed lazily; duplicated emails in the input and
+    emails already in the database are skipped. Passwords are hashed in a
+    pool of ``workers`` processes, or stored as given if ``prehashed``.
+
+    Returns a ``(created, skipped)`` tuple.
+    """
+    user_model = user_model or get_user_model()
+    base_user = get_user_model()  # Make sure to check User, not inheriting models
+    allocate = get_username_allocator()
+    max_attempts = getattr(settings, 'BASE_ACCOUNTS_USERNAME_MAX_ATTEMPTS', 5)
+    pool = Pool(workers) if workers and not prehashed else None
+    seen = set()
+    created = skipped = 0
+
+    try:
+        for batch in _batches(rows, batch_size):
+
+            # Drop rows without email or already seen in this import
+            pending = []
+            for row in batch:
+                email = normalize_email(row.get('email'))
+                if not email or email in seen:
+                    skipped += 1
+                    continue
+                seen.add(email)
+                pending.append((email, row))
+
+            # Drop rows whose email is already in use, with one query per batch
+            emails = [email for email, row in pending]
+            lookup = Q(normalized_email__in=emails)
+            if emails and unnormalized_emails_exist():
+                lookup |= Q(normalized_email=None) & reduce(operator.or_, [Q(email__iexact=email) for email in emails])
+            existing = set(normalize_email(email) for email in base_user.objects.filter(
+                lookup
+            ).values_list('email', flat=True))
+            skipped += len(existing)
+            pending = [(email, row) for email, row in pending if email not in existing]
+            if not pending:
+                continue
+
+            # Hash passwords
+            passwords = [row.get('password') for email, row in pending]
+            if not prehashed:
+                passwords = pool.map(make_password, passwords) if pool else [make_password(p) for p in passwords]
+            else:
+                passwords = [p or make_password(None) for p in passwords]
+
+            # Build instances, filling what ``BaseUser.save`` would compute
+            users = []
+            for (email, row), password in zip(pending, passwords):
+                fields = dict(row, email=email, password=password)
+                fields['username'] = allocate(email, 0)
+                fields['slug'] = slugify(fields['username'])
+                fields['normalized_email'] = email
+                users.append(user_model(**fields))
+
+            try:
+                with transaction.atomic():
+                    user_model.objects.bulk_create(users, batch_size=batch_size)
+                created += len(users)
+
+                # ``bulk_create`` skips ``BaseUser.save``, which does this for single users
+                for user in users:
+                    email_filter.add(user.normalized_email)
+                db.mark_write()
+            except IntegrityError:
+                # Some username or email collided, insert this batch row by row
+                for user in users:
+                    if _save_one(user, base_user, allocate, max_attempts):
+                        created += 1
+                    else:
+                        skipped += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return created, skipped
+
+
+def purge_unconfirmed_users(cutoff, batch_size=1000, sleep=0, dry_run=False, deactivate=False, progress=None,
+                            queryset=None):
+    """
+    Delete users who never confirmed their email and joined before
+    ``cutoff``, or deactivate them if ``deactivate``, among ``queryset``
+    (all users by default). The table is walked in primary key batches,
+    each removed in its own transaction and followed by ``sleep`` seconds so
+    replicas can keep up. Users are checked again inside the transaction, so
+    those who confirmed meanwhile are kept. ``progress`` is called with the
+    running count after each batch.
+
+    Returns the number of users purged, or that would be with ``dry_run``.
+    """
+    user_model = get_user_model()
+    if queryset is None:
+        queryset = user_model.objects.all()
+    queryset = queryset.filter(confirmed=None, date_joined__lt=cutoff)
+    if deactivate:
+        queryset = queryset.filter(is_active=True)
+    purged = 0
+
+    for chunk in chunked_queryset(queryset.values_list('pk'), batch_size):
+        pks = [row[0] for row in chunk]
+        if dry_run:
+            purged += len(pks)
+        else:
+            with transaction.atomic():
+                batch = queryset.filter(pk__in=pks)
+                if deactivate:
+                    purged += batch.update(is_active=False)
+                else:
+                    pks = list(batch.select_for_update().values_list('pk', flat=True))
+                    user_model.objects.filter(pk__in=pks).delete()
+                    purged += len(pks)
+        if progress is not None:
+            progress(purged)
+        if sleep and not dry_run:
+            time.sleep(sleep)
+
+    return purged
+
+
+def _export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _csv_value(value):
+    """Python 2 ``csv`` only writes byte strings"""
+    return value.encode('utf-8') if six.PY2 and isinstance(value, six.text_type) else value
+
+
+def export_users(fields=EXPORT_FIELDS, fmt='csv', confirmed=None, is_active=None, chunk_size=2000, compress=False):
+    """
+    Yield users as CSV (with a header row) or JSON lines, as byte strings,
+    gzipped if ``compress``. Rows are read in primary key batches of
+    ``chunk_size`` so memory stays constant. ``confirmed`` and ``is_active``
+    filter users when not None.
+    """
+    queryset = get_user_model().objects.all()
+    if confirmed is not None:
+        queryset = queryset.filter(confirmed__isnull=not confirmed)
+    if is_active is not None:
+        queryset = queryset.filter(is_active=is_active)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    writer = csv.writer(_Echo())
+
+    def lines():
+        if fmt == 'csv':
+            yield writer.writerow(fields)
+        for chunk in chunked_queryset(queryset.values_list('pk', *fields), chunk_size):
+            rows = [[_export_value(value) for value in row[1:]] for row in chunk]
+            if fmt == 'csv':
+                yield ''.join(writer.writerow([_csv_value(value) for value in row]) for row in rows)
+            else:
+                yield ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+    for text in lines():
+        data = text if isinstance(text, bytes) else text.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,65 @@
+"""
+Routing of account lookups to a read replica.
+
+With ``BASE_ACCOUNTS_READ_DATABASE`` set, email existence checks and
+credential lookups read from that database alias. After a write to a user,
+reads are pinned to the primary for the rest of the request and, with
+``PrimaryPinningMiddleware``, for the client's next requests during
+``BASE_ACCOUNTS_PRIMARY_PIN_SECONDS``, so users read their own writes.
+Pins are cleared when each request starts and finishes.
+"""
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import router
+
+_local = threading.local()
+
+
+def mark_write():
+    """
+    Record a write to a user, pinning reads to the primary
+    """
+    _local.pinned = _local.wrote = True
+
+
+def pin_to_primary():
+    _local.pinned = True
+
+
+def reset():
+    _local.pinned = _local.wrote = False
+
+
+def _reset_on_request(sender, **kwargs):
+    reset()
+
+request_started.connect(_reset_on_request, dispatch_uid='base_accounts.db.request_started')
+request_finished.connect(_reset_on_request, dispatch_uid='base_accounts.db.request_finished')
+
+
+def read_alias():
+    """
+    Database alias for account lookups, or None for the default routing
+    """
+    if getattr(_local, 'pinned', False):
+        return None
+    return getattr(settings, 'BASE_ACCOUNTS_READ_DATABASE', None)
+
+
+def for_read(model):
+    """
+    Return a queryset of ``model`` reading from the replica if configured
+    """
+    queryset = model._default_manager.all()
+    alias = read_alias()
+    return queryset.using(alias) if alias else queryset
+
+
+def detach(instance):
+    """
+    Make an instance read from the replica save to the write database
+    """
+    instance._state.db = router.db_for_write(type(instance))
+    return instance
@@ -0,0 +1,164 @@
+"""
+Process-local Bloom filter of known user emails.
+
+Built from the user table by a background thread on first use and updated
+by ``BaseUser.save``, it lets ``EmailBackend`` tell emails that certainly do
+not exist apart from ones that may. Lookups are counted so false positives and stale negatives can be
+observed with ``stats()`` before trusting the filter to skip queries.
+"""
+import binascii
+import hashlib
+import logging
+import math
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from base_accounts.utils import chunked_queryset, normalize_email
+
+
+class BloomFilter(object):
+    """
+    Fixed size Bloom filter sized for ``capacity`` items at ``error_rate``
+    false positive probability
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(1, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.md5(item.encode('utf-8')).digest()
+        h1 = int(binascii.hexlify(digest[:8]), 16)
+        h2 = int(binascii.hexlify(digest[8:]), 16)
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+_filter = None
+_added = None  # Emails saved while a build runs
+_thread = None
+_stats = {'negatives': 0, 'false_positives': 0, 'stale': 0}
+
+
+def enabled():
+    return getattr(settings, 'BASE_ACCOUNTS_EMAIL_FILTER', False)
+
+
+def trusted():
+    """
+    Whether negative answers may skip the database lookup
+    """
+    return enabled() and getattr(settings, 'BASE_ACCOUNTS_EMAIL_FILTER_TRUSTED', False)
+
+
+def rebuild():
+    """
+    Build a new filter from every normalized email in the user table. Runs
+    one build at a time, including emails saved while it reads the table.
+    """
+    global _filter, _added
+    with _build_lock:
+        with _lock:
+            _added = []
+        new_filter = BloomFilter(
+            getattr(settings, 'BASE_ACCOUNTS_EMAIL_FILTER_CAPACITY', 1000000),
+            getattr(settings, 'BASE_ACCOUNTS_EMAIL_FILTER_ERROR_RATE', 0.01),
+        )
+        try:
+            queryset = get_user_model().objects.values_list('pk', 'normalized_email', 'email')
+            for chunk in chunked_queryset(queryset, 10000):
+                for pk, normalized, email in chunk:
+                    normalized = normalized or normalize_email(email)  # Not backfilled yet
+                    if normalized:
+                        new_filter.add(normalized)
+        finally:
+            with _lock:
+                for email in _added:
+                    new_filter.add(email)
+                _added = None
+        with _lock:
+            _filter = new_filter
+    return new_filter
+
+
+def _build():
+    global _thread
+    try:
+        rebuild()
+    except Exception:
+        logger.exception("Could not build the email filter")
+    finally:
+        with _lock:
+            _thread = None  # Let the next lookup try again if it failed
+        connection.close()
+
+
+def might_contain(email):
+    """
+    Return False if ``email`` is certainly not in use, True if it may be,
+    or None when the filter is disabled or not built yet. The first lookup
+    starts building it in the background.
+    """
+    global _thread
+    if not enabled():
+        return None
+    current = _filter
+    if current is None:
+        with _lock:
+            if _thread is None:
+                _thread = threading.Thread(target=_build, name='base_accounts-email-filter')
+                _thread.daemon = True
+                _thread.start()
+        return None
+    found = email in current
+    if not found:
+        with _lock:
+            _stats['negatives'] += 1
+    return found
+
+
+def add(email):
+    if not email:
+        return
+    with _lock:
+        if _added is not None:
+            _added.append(email)
+        if _filter is not None:
+            _filter.add(email)
+
+
+def record_lookup(email, answer, exists):
+    """
+    Record the database outcome for an email the filter answered ``answer``
+    """
+    if answer is None or answer == exists:
+        return
+    with _lock:
+        if answer:
+            _stats['false_positives'] += 1
+        else:
+            _stats['stale'] += 1  # Added by another process
+    if exists:
+        add(email)
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
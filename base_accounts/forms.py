@@ -1,30 +1,32 @@
 from django import forms
-from django.contrib.auth import authenticate, login, get_user_model
+from django.conf import settings
+from django.contrib.auth import authenticate, login
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
-from base_accounts.utils import create_email_user
+from base_accounts import db, mail, throttling
+from base_accounts.hashing import HashingUnavailable
+from base_accounts.instrumentation import Timer
+from base_accounts.utils import LazyUserModel, create_email_user, email_lookup, normalize_email
 
 
 class SignupFormMixin(object):
 
     def clean_email(self, *args, **kwargs):
 
-        # Get lowercase email
-        email = self.cleaned_data.get('email').lower()
+        # Get normalized email
+        email = normalize_email(self.cleaned_data.get('email'))
 
         # Get auth model
-        if self.clean_email_user_model:
+        if getattr(self, 'clean_email_user_model', None):
             model = self.clean_email_user_model
         else:
             model = self.user_model
 
         # Check if email is already being used
-        try:
-            model.objects.get(email=email)
-        except model.DoesNotExist:
-            return email
-        else:
+        if db.for_read(model).filter(email_lookup(email)).exists():
             raise forms.ValidationError(_("Email is already being used by another user"))
+        return email
 
     def save(self, *args, **kwargs):
 
@@ -33,12 +35,20 @@ class SignupFormMixin(object):
         email = self.cleaned_data.get('email').lower()
         password = self.cleaned_data.get('password')
 
-        # Create new user
-        user = create_email_user(email, password, self.user_model, **{'name': full_name})
+        timer = Timer('signup')
 
-        # Authenticate and login user
-        user = authenticate(username=user.username, password=password)
+        # Create new user, queued for a confirmation email if enabled
+        extrafields = {'name': full_name}
+        if mail.enabled():
+            extrafields['confirmation_requested'] = now()
+        user = create_email_user(email, password, self.user_model, **extrafields)
+        timer.phase('create')
+
+        # Login user. The password has just been hashed, so log the new user
+        # in with an explicit backend instead of checking it again.
+        user.backend = getattr(settings, 'BASE_ACCOUNTS_LOGIN_BACKEND', 'django.contrib.auth.backends.ModelBackend')
         login(self.request, user)
+        timer.phase('login')
 
         return user
 
@@ -48,7 +58,7 @@ class SignupForm(SignupFormMixin, forms.Form):
     email = forms.EmailField(label=_('email'))
     password = forms.CharField(label=_('password'), widget=forms.PasswordInput)
     tos = forms.BooleanField(label=_('I accept the terms of service'))
-    user_model = get_user_model()
+    user_model = LazyUserModel()
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request', None)
@@ -76,21 +86,39 @@ class LoginForm(forms.Form):
         if email is None or password is None:
             return cleaned_data
 
+        timer = Timer('login')
+
+        # Reject without hashing when there were too many failed attempts
+        throttle_keys = throttling.login_keys(self.request, email)
+        if throttling.is_throttled(throttle_keys):
+            timer.phase('throttle', 'throttled')
+            raise forms.ValidationError(_("Too many failed login attempts, please try again later"))
+        timer.phase('throttle')
+
         # Check that email and password match and user is active
-        user = authenticate(email=email, password=password)
+        try:
+            user = authenticate(email=email, password=password)
+        except HashingUnavailable:
+            timer.phase('authenticate', 'unavailable')
+            raise forms.ValidationError(_("Too many requests, please try again later"))
         if user is None:
+            throttling.record_failure(throttle_keys)
+            timer.phase('authenticate', 'failed')
             raise forms.ValidationError(_("Please insert both valid email and password"))
         elif not user.is_active:
+            timer.phase('authenticate', 'inactive')
             raise forms.ValidationError(_("Your account is inactive"))
+        timer.phase('authenticate')
 
         # Login user
         login(self.request, user)
+        timer.phase('session', 'success')
         return cleaned_data
 
 
 class UpdateEmailForm(forms.Form):
     email = forms.EmailField(required=True)
-    user_model = get_user_model()
+    user_model = LazyUserModel()
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request', None)
@@ -99,18 +127,15 @@ class UpdateEmailForm(forms.Form):
 
     def clean_email(self, *args, **kwargs):
         data = self.cleaned_data['email']
-        try:
-            self.user_model.objects.exclude(id=self.user.id).get(email=data)
-        except self.user_model.DoesNotExist:
-            return data
-        else:
+        if db.for_read(self.user_model).exclude(id=self.user.id).filter(email_lookup(normalize_email(data))).exists():
             raise forms.ValidationError(_("Email is already being used by another user"))
+        return data
 
 
 class UpdatePasswordForm(forms.Form):
     password1 = forms.CharField(label=_('new password'), widget=forms.PasswordInput,)
     password2 = forms.CharField(label=_('new password (confirm)'), widget=forms.PasswordInput,)
-    user_model = get_user_model()
+    user_model = LazyUserModel()
 
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request', None)
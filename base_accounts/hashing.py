@@ -0,0 +1,122 @@
+"""
+Optional executor for password hashing.
+
+When ``BASE_ACCOUNTS_HASHING_EXECUTOR`` is set, password hashes run in a
+bounded thread or process pool instead of inline, so a burst of logins or
+signups is shed with ``HashingUnavailable`` rather than piling up on the
+request workers. Otherwise everything runs inline as plain Django would.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from concurrent import futures
+except ImportError:  # Python 2 without the ``futures`` backport
+    futures = None
+
+
+class HashingUnavailable(Exception):
+    """
+    Password hashing was rejected because the executor queue is full or
+    did not finish within ``BASE_ACCOUNTS_HASHING_TIMEOUT``
+    """
+    pass
+
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+_stats = {'pending': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0, 'hash_time': 0.0}
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def _check_password(raw_password, encoded):
+    updated = []
+    valid = hashers.check_password(raw_password, encoded, updated.append)
+    return valid, bool(updated)
+
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            if futures is None:
+                raise ImproperlyConfigured("BASE_ACCOUNTS_HASHING_EXECUTOR requires the 'futures' package on Python 2")
+            kind = getattr(settings, 'BASE_ACCOUNTS_HASHING_EXECUTOR', None)
+            if kind not in ('thread', 'process'):
+                raise ImproperlyConfigured("BASE_ACCOUNTS_HASHING_EXECUTOR must be 'thread' or 'process'")
+            workers = getattr(settings, 'BASE_ACCOUNTS_HASHING_WORKERS', 4)
+            queue_size = getattr(settings, 'BASE_ACCOUNTS_HASHING_QUEUE_SIZE', 16)
+            executor_class = futures.ProcessPoolExecutor if kind == 'process' else futures.ThreadPoolExecutor
+            _slots = threading.BoundedSemaphore(workers + queue_size)
+            _executor = executor_class(workers)
+    return _executor
+
+
+def _update_stats(**deltas):
+    with _lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+
+def _release(future):
+    _update_stats(pending=-1)
+    _slots.release()
+
+
+def _run(func, *args):
+    if not getattr(settings, 'BASE_ACCOUNTS_HASHING_EXECUTOR', None):
+        return func(*args)
+
+    executor = _get_executor()
+
+    # Apply backpressure: reject at once instead of queueing without bound
+    if not _slots.acquire(False):
+        _update_stats(rejected=1)
+        raise HashingUnavailable
+
+    _update_stats(pending=1)
+    future = executor.submit(_timed, func, *args)
+    future.add_done_callback(_release)
+    try:
+        result, duration = future.result(getattr(settings, 'BASE_ACCOUNTS_HASHING_TIMEOUT', 5))
+    except futures.TimeoutError:
+        future.cancel()
+        _update_stats(timeouts=1)
+        raise HashingUnavailable
+    _update_stats(completed=1, hash_time=duration)
+    return result
+
+
+def make_password(raw_password, hasher='default'):
+    """
+    Hash ``raw_password`` with ``hasher``, the default one unless given
+    """
+    return _run(hashers.make_password, raw_password, None, hasher)
+
+
+def check_password(raw_password, encoded):
+    """
+    Return a ``(valid, must_update)`` tuple telling whether ``raw_password``
+    matches ``encoded`` and whether the hash should be upgraded
+    """
+    return _run(_check_password, raw_password, encoded)
+
+
+def stats():
+    """
+    Return a snapshot of executor metrics: hashes queued or running
+    (``pending``), finished (``completed``), shed (``rejected`` and
+    ``timeouts``) and total seconds spent hashing (``hash_time``)
+    """
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,95 @@
+"""
+Timing of authentication, login and signup phases.
+
+Code paths time their phases with ``Timer``, which sends
+``signals.auth_phase`` for each one. Nothing is timed while the signal has
+no receivers. ``StatsdExporter`` and ``PrometheusExporter`` are ready made
+receivers.
+"""
+import socket
+import threading
+import time
+
+from base_accounts.signals import auth_phase
+
+
+class Timer(object):
+    """
+    Times consecutive phases of ``operation``: each ``phase()`` call reports
+    the time elapsed since the previous one, or since the timer was created
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.active = bool(auth_phase.receivers)
+        if self.active:
+            self.last = time.time()
+
+    def phase(self, name, outcome=None):
+        if not self.active:
+            return
+        current = time.time()
+        auth_phase.send(sender=Timer, operation=self.operation, phase=name,
+                        duration=current - self.last, outcome=outcome)
+        self.last = current
+
+
+class StatsdExporter(object):
+    """
+    Sends phase durations as StatsD timers and outcomes as counters over UDP
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='base_accounts'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, sender, operation, phase, duration, outcome=None, **kwargs):
+        name = '%s.%s.%s' % (self.prefix, operation, phase)
+        lines = ['%s:%.3f|ms' % (name, duration * 1000)]
+        if outcome:
+            lines.append('%s.%s:1|c' % (name, outcome))
+        try:
+            self.sock.sendto('\n'.join(lines).encode('ascii'), self.address)
+        except socket.error:
+            pass  # Metrics must never break logins
+
+    def connect(self):
+        auth_phase.connect(self, weak=False, dispatch_uid='base_accounts.statsd')
+
+
+class PrometheusExporter(object):
+    """
+    Aggregates phase durations and outcomes in memory and renders them in
+    the Prometheus text format, e.g. from a metrics view
+    """
+
+    def __init__(self, prefix='base_accounts'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.outcomes = {}
+
+    def __call__(self, sender, operation, phase, duration, outcome=None, **kwargs):
+        with self.lock:
+            count, total = self.durations.get((operation, phase), (0, 0.0))
+            self.durations[(operation, phase)] = (count + 1, total + duration)
+            if outcome:
+                key = (operation, phase, outcome)
+                self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def connect(self):
+        auth_phase.connect(self, weak=False, dispatch_uid='base_accounts.prometheus')
+
+    def render(self):
+        lines = ['# TYPE %s_phase_seconds summary' % self.prefix]
+        with self.lock:
+            for (operation, phase), (count, total) in sorted(self.durations.items()):
+                labels = 'operation="%s",phase="%s"' % (operation, phase)
+                lines.append('%s_phase_seconds_sum{%s} %f' % (self.prefix, labels, total))
+                lines.append('%s_phase_seconds_count{%s} %d' % (self.prefix, labels, count))
+            lines.append('# TYPE %s_outcomes_total counter' % self.prefix)
+            for (operation, phase, outcome), count in sorted(self.outcomes.items()):
+                labels = 'operation="%s",phase="%s",outcome="%s"' % (operation, phase, outcome)
+                lines.append('%s_outcomes_total{%s} %d' % (self.prefix, labels, count))
+        return '\n'.join(lines) + '\n'
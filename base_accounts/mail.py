@@ -0,0 +1,122 @@
+"""
+Confirmation mail pipeline.
+
+Users are queued for a confirmation email by setting
+``BaseUser.confirmation_requested``. ``send_pending_confirmations`` (and the
+``send_confirmation_emails`` command) drains that queue in batches over a
+single mail connection. Each message is sent on its own and retried with
+exponential backoff, so a failure never sends the rest of its batch twice.
+"""
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage, get_connection
+from django.core.urlresolvers import reverse
+from django.template import Context
+from django.template.loader import select_template
+from django.utils import translation
+from django.utils.timezone import now
+
+from base_accounts.utils import chunked_queryset
+
+logger = logging.getLogger(__name__)
+
+_templates = {}
+
+
+def enabled():
+    return getattr(settings, 'BASE_ACCOUNTS_CONFIRMATION_MAIL', False)
+
+
+def get_templates(language):
+    """
+    Return subject and body templates for ``language``, loaded once and
+    looked up first under ``base_accounts/<language>/``
+    """
+    if language not in _templates:
+        _templates[language] = tuple(
+            select_template(['base_accounts/%s/%s' % (language, name), 'base_accounts/%s' % name])
+            for name in ('confirmation_email_subject.txt', 'confirmation_email.txt')
+        )
+    return _templates[language]
+
+
+def build_message(user, language=None):
+    site_url = getattr(settings, 'BASE_ACCOUNTS_SITE_URL', None)
+    if not site_url:
+        raise ImproperlyConfigured("BASE_ACCOUNTS_SITE_URL is required to send confirmation emails")
+    language = language or settings.LANGUAGE_CODE
+    subject_template, body_template = get_templates(language)
+    context = {
+        'user': user,
+        'confirmation_url': site_url.rstrip('/') + reverse('confirm_email_address', kwargs={'token': user.get_confirmation_token()}),
+    }
+    with translation.override(language):
+        subject = ' '.join(_render(subject_template, context).splitlines()).strip()
+        body = _render(body_template, context)
+    return EmailMessage(subject, body, to=[user.email])
+
+
+def _render(template, context):
+    # Django 1.8+ backend templates take a dict, older ones a Context
+    if hasattr(template, 'backend'):
+        return template.render(context)
+    return template.render(Context(context))
+
+
+def _send(connection, message, retries, backoff):
+    """
+    Send ``message``, retrying temporary failures. Returns False if its
+    recipient was refused, as retrying would never succeed.
+    """
+    for attempt in range(retries + 1):
+        try:
+            connection.send_messages([message])
+            return True
+        except smtplib.SMTPRecipientsRefused:
+            logger.warning("Confirmation email to %s refused", ', '.join(message.to))
+            return False
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            connection.close()
+            connection.open()
+
+
+def send_pending_confirmations(batch_size=100, retries=3, backoff=1, language=None, connection=None):
+    """
+    Send a confirmation email to every queued user and return how many
+    were sent. Users whose recipient is refused are dequeued without a
+    message. A message still failing after ``retries`` attempts raises and
+    stays queued, along with the rest of the queue.
+    """
+    user_model = get_user_model()
+    queryset = user_model.objects.exclude(confirmation_requested=None).filter(confirmed=None)
+    connection = connection or get_connection()
+    sent = 0
+
+    connection.open()
+    try:
+        for chunk in chunked_queryset(queryset, batch_size):
+            started = now()
+            done = []
+            try:
+                for user in chunk:
+                    if _send(connection, build_message(user, language), retries, backoff):
+                        sent += 1
+                    done.append(user.pk)
+            finally:
+                # Dequeue messages already handled, unless requested again while sending
+                if done:
+                    user_model.objects.filter(
+                        pk__in=done, confirmation_requested__lte=started
+                    ).update(confirmation_requested=None)
+    finally:
+        connection.close()
+
+    return sent
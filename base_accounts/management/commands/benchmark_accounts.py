@@ -0,0 +1,238 @@
+import cProfile
+import os
+import time
+from datetime import timedelta
+from importlib import import_module
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import NoArgsCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test import Client, RequestFactory
+from django.test.runner import DiscoverRunner
+from django.test.utils import (CaptureQueriesContext, override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+
+from base_accounts import hashing, session_index, slugs, throttling
+from base_accounts.bulk import bulk_create_email_users, purge_unconfirmed_users
+from base_accounts.utils import chunked_queryset, create_email_user
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+SCENARIOS = ('create_email_user', 'signup', 'login', 'confirm_email_address', 'update_email', 'purge_unconfirmed_users',
+             'revoke_sessions', 'throttled_login', 'resolve_slug')
+LOGIN_THROTTLE = (5, 300)
+SCENARIO_SETTINGS = {'revoke_sessions': {'BASE_ACCOUNTS_SESSION_INDEX': True},
+                     'throttled_login': {'BASE_ACCOUNTS_LOGIN_THROTTLE': LOGIN_THROTTLE}}
+PASSWORD = 'benchmark-password'
+PURGE_BATCH_SIZE = 100
+SESSIONS_PER_USER = 5
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+class CaptureAllQueries(object):
+    """Like ``CaptureQueriesContext``, for every database connection"""
+
+    def __enter__(self):
+        self.contexts = [CaptureQueriesContext(connections[alias]) for alias in connections]
+        for context in self.contexts:
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in reversed(self.contexts):
+            context.__exit__(*exc_info)
+
+    def __len__(self):
+        return sum(len(context) for context in self.contexts)
+
+
+class Command(NoArgsCommand):
+    help = ("Benchmark account views and create_email_user, reporting latency, queries per request and "
+            "password hash time. Runs against throwaway test databases unless --use-configured-db is given.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--requests', type='int', dest='requests', default=100,
+                    help='Requests per scenario'),
+        make_option('--scenario', action='append', dest='scenarios', choices=SCENARIOS,
+                    help='Scenario to run, may be repeated. All of them by default'),
+        make_option('--use-configured-db', action='store_true', dest='use_configured_db', default=False,
+                    help='Create benchmark users in the configured databases instead of test ones'),
+        make_option('--profile', dest='profile', choices=('cprofile', 'pyinstrument'), default=None,
+                    help='Profile each scenario'),
+        make_option('--profile-dir', dest='profile_dir', default='.',
+                    help='Directory where profiles are written'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['profile'] == 'pyinstrument' and pyinstrument is None:
+            raise CommandError("pyinstrument is not installed")
+        self.options = options
+        self.domain = '%s.benchmark.invalid' % get_random_string(8).lower()
+        self.user_model = get_user_model()
+
+        setup_test_environment()
+        runner = old_config = None
+        if not options['use_configured_db']:
+            runner = DiscoverRunner(verbosity=0)
+            old_config = runner.setup_databases()
+        try:
+            self.report('password hash', self.time_hashes(), None)
+            self.users = []
+            for scenario in options['scenarios'] or SCENARIOS:
+                with override_settings(**SCENARIO_SETTINGS.get(scenario, {})):
+                    timings, queries = self.run_scenario(scenario)
+                self.report(scenario, timings, queries)
+        finally:
+            if runner is not None:
+                runner.teardown_databases(old_config)
+            else:
+                self.user_model.objects.filter(normalized_email__endswith='@' + self.domain).delete()
+            teardown_test_environment()
+
+    def email(self):
+        return '%s@%s' % (get_random_string(12).lower(), self.domain)
+
+    def report(self, name, timings, queries):
+        line = "%-24s p50 %8.2f ms  p99 %8.2f ms" % (name, percentile(timings, .5) * 1000, percentile(timings, .99) * 1000)
+        if queries is not None:
+            line += "  %.1f queries/request" % (sum(queries) / float(len(queries)))
+        self.stdout.write(line)
+
+    def time_hashes(self):
+        timings = []
+        for i in range(self.options['requests']):
+            start = time.time()
+            hashing.make_password(PASSWORD)
+            timings.append(time.time() - start)
+        return timings
+
+    def run_scenario(self, scenario):
+        steps = getattr(self, 'prepare_%s' % scenario)()
+        timings, queries = [], []
+        profiler = None
+        if self.options['profile'] == 'cprofile':
+            profiler = cProfile.Profile()
+        elif self.options['profile'] == 'pyinstrument':
+            profiler = pyinstrument.Profiler()
+
+        for step in steps:
+            with CaptureAllQueries() as captured:
+                if profiler is not None:
+                    profiler.enable() if hasattr(profiler, 'enable') else profiler.start()
+                start = time.time()
+                step()
+                timings.append(time.time() - start)
+                if profiler is not None:
+                    profiler.disable() if hasattr(profiler, 'disable') else profiler.stop()
+            queries.append(len(captured))
+
+        if isinstance(profiler, cProfile.Profile):
+            profiler.dump_stats(os.path.join(self.options['profile_dir'], '%s.prof' % scenario))
+        elif profiler is not None:
+            with open(os.path.join(self.options['profile_dir'], '%s.txt' % scenario), 'w') as f:
+                f.write(profiler.output_text())
+        return timings, queries
+
+    def ensure_users(self):
+        """Users with a known password for scenarios that need existing accounts"""
+        while len(self.users) < self.options['requests']:
+            self.users.append(create_email_user(self.email(), PASSWORD))
+        return self.users
+
+    def prepare_create_email_user(self):
+        def step():
+            self.users.append(create_email_user(self.email(), PASSWORD))
+        return [step] * self.options['requests']
+
+    def prepare_signup(self):
+        url = reverse('signup')
+
+        def step():
+            data = {'full_name': 'Benchmark', 'email': self.email(), 'password': PASSWORD, 'tos': 'on'}
+            Client().post(url, data)
+        return [step] * self.options['requests']
+
+    def prepare_login(self):
+        url = reverse('login')
+        steps = []
+        for user in self.ensure_users():
+            steps.append(lambda user=user: Client().post(url, {'email': user.email, 'password': PASSWORD}))
+        return steps
+
+    def prepare_confirm_email_address(self):
+        users = self.ensure_users()
+        self.user_model.objects.filter(pk__in=[user.pk for user in users]).update(confirmed=None)
+        steps = []
+        for user in users:
+            url = reverse('confirm_email_address', kwargs={'token': user.get_confirmation_token()})
+            steps.append(lambda url=url: Client().get(url))
+        return steps
+
+    def prepare_update_email(self):
+        url = reverse('settings_update_email')
+        steps = []
+        for user in self.ensure_users():
+            client = Client()
+            client.post(reverse('login'), {'email': user.email, 'password': PASSWORD})
+            steps.append(lambda client=client: client.post(url, {'email': self.email()}))
+        return steps
+
+    def prepare_purge_unconfirmed_users(self):
+        """One purge batch per request, over stale unconfirmed benchmark users"""
+        cutoff = now() - timedelta(days=30)
+        rows = ({'email': self.email(), 'password': None, 'date_joined': cutoff - timedelta(days=1)}
+                for i in range(self.options['requests'] * PURGE_BATCH_SIZE))
+        bulk_create_email_users(rows, prehashed=True)
+        stale = self.user_model.objects.filter(
+            normalized_email__endswith='@' + self.domain, confirmed=None, date_joined__lt=cutoff)
+        steps = []
+        for chunk in chunked_queryset(stale.values_list('pk'), PURGE_BATCH_SIZE):
+            users = self.user_model.objects.filter(pk__in=[row[0] for row in chunk])
+            steps.append(lambda users=users: purge_unconfirmed_users(cutoff, PURGE_BATCH_SIZE, queryset=users))
+        return steps
+
+    def prepare_revoke_sessions(self):
+        """Revoke the other sessions of users logged in from several devices"""
+        engine = import_module(settings.SESSION_ENGINE)
+        steps = []
+        for user in self.ensure_users():
+            sessions = []
+            for i in range(SESSIONS_PER_USER):
+                request = RequestFactory().get('/')
+                request.session = engine.SessionStore()
+                request.session[SESSION_KEY] = user.pk
+                request.session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+                request.session.save()
+                session_index.track_login(None, request=request, user=user)
+                sessions.append(request.session.session_key)
+            steps.append(lambda user=user, keep=sessions[0]: session_index.revoke_sessions(user, keep=keep))
+        return steps
+
+    def prepare_throttled_login(self):
+        """Logins rejected because their email reached the failure limit"""
+        url = reverse('login')
+        steps = []
+        for user in self.ensure_users():
+            for i in range(LOGIN_THROTTLE[0]):
+                throttling.record_failure(throttling.login_keys(None, user.email))
+            steps.append(lambda user=user: Client().post(url, {'email': user.email, 'password': PASSWORD}))
+        return steps
+
+    def prepare_resolve_slug(self):
+        """Resolve user slugs through a warm slug cache"""
+        steps = []
+        for user in self.ensure_users():
+            slugs.get_user_pk(user.slug)
+            steps.append(lambda slug=user.slug: slugs.get_user(slug))
+        return steps
@@ -0,0 +1,44 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from base_accounts.bulk import EXPORT_FIELDS, export_users
+
+BOOLEANS = {'yes': True, 'no': False}
+
+
+class Command(NoArgsCommand):
+    help = "Export users as CSV or JSON lines"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--format', dest='format', choices=('csv', 'jsonl'), default='csv'),
+        make_option('--fields', dest='fields', default=','.join(EXPORT_FIELDS),
+                    help='Comma separated user fields to export'),
+        make_option('--confirmed', dest='confirmed', choices=tuple(BOOLEANS), default=None,
+                    help='Only export users with (yes) or without (no) a confirmed email'),
+        make_option('--active', dest='active', choices=tuple(BOOLEANS), default=None,
+                    help='Only export active (yes) or inactive (no) users'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=2000,
+                    help='Number of users read at a time'),
+        make_option('--gzip', action='store_true', dest='gzip', default=False,
+                    help='Compress output with gzip'),
+        make_option('--output', dest='output', default=None,
+                    help='Output file, standard output by default'),
+    )
+
+    def handle_noargs(self, **options):
+        chunks = export_users(
+            fields=tuple(options['fields'].split(',')),
+            fmt=options['format'],
+            confirmed=BOOLEANS.get(options['confirmed']),
+            is_active=BOOLEANS.get(options['active']),
+            chunk_size=options['chunk_size'],
+            compress=options['gzip'],
+        )
+        output = open(options['output'], 'wb') if options['output'] else getattr(sys.stdout, 'buffer', sys.stdout)
+        try:
+            for data in chunks:
+                output.write(data)
+        finally:
+            if options['output']:
+                output.close()
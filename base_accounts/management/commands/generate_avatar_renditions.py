@@ -0,0 +1,46 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.auth import get_user_model
+
+from base_accounts.avatars import generate_renditions
+from base_accounts.utils import chunked_queryset
+
+
+class Command(NoArgsCommand):
+    help = "Generate avatar renditions for existing user images"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of users read at a time'),
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of images processed in parallel'),
+        make_option('--overwrite', action='store_true', dest='overwrite', default=False,
+                    help='Regenerate renditions that already exist'),
+    )
+
+    def handle_noargs(self, **options):
+        overwrite = options['overwrite']
+        queryset = get_user_model().objects.exclude(image=None).exclude(image='').values_list('pk', 'image')
+        pool = ThreadPool(options['workers'])
+        processed = written = failed = 0
+
+        def generate(image_name):
+            try:
+                return generate_renditions(image_name, overwrite=overwrite)
+            except Exception as e:
+                self.stderr.write("%s: %s" % (image_name, e))
+                return None
+
+        try:
+            for chunk in chunked_queryset(queryset, options['batch_size']):
+                for result in pool.map(generate, [image for pk, image in chunk]):
+                    if result is None:
+                        failed += 1
+                    else:
+                        written += result
+                processed += len(chunk)
+                self.stdout.write("%d images processed, %d renditions written, %d failed" % (processed, written, failed))
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,63 @@
+import csv
+import json
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base_accounts.bulk import bulk_create_email_users
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def read_csv(f):
+    for row in csv.DictReader(f):
+        yield row
+
+
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Create users in bulk from a CSV or JSON lines file with email, password and other user fields"
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', choices=('csv', 'jsonl'), default=None,
+                    help='Input format, guessed from the file extension by default'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of rows checked and inserted at a time'),
+        make_option('--workers', type='int', dest='workers', default=None,
+                    help='Number of processes used to hash passwords'),
+        make_option('--prehashed', action='store_true', dest='prehashed', default=False,
+                    help='Passwords in the file are already hashed'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: import_email_users %s" % self.args)
+        path = args[0]
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        reader = read_jsonl if fmt == 'jsonl' else read_csv
+
+        start = time.time()
+        with open(path) as f:
+            created, skipped = bulk_create_email_users(
+                reader(f),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                prehashed=options['prehashed'],
+            )
+        elapsed = time.time() - start
+
+        total = created + skipped
+        self.stdout.write("%d users created, %d skipped" % (created, skipped))
+        self.stdout.write("%.1f rows/second" % (total / elapsed if elapsed else total))
+        if resource is not None:
+            self.stdout.write("peak memory: %d KB" % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
@@ -0,0 +1,56 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from base_accounts.utils import chunked_queryset, normalize_email
+
+
+class Command(NoArgsCommand):
+    help = ("Backfill BaseUser.normalized_email from the email field. Users whose email only differs in case "
+            "from another user's are reported and left out.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of users read and updated per transaction'),
+    )
+
+    def handle_noargs(self, **options):
+        user_model = get_user_model()
+        queryset = user_model.objects.values_list('pk', 'email', 'normalized_email')
+
+        # Find emails shared by several users once normalized, which the
+        # unique index would reject
+        owners, duplicated = {}, set()
+        for chunk in chunked_queryset(queryset, options['batch_size']):
+            for pk, email, current in chunk:
+                value = normalize_email(email)
+                if value and owners.setdefault(value, pk) != pk:
+                    duplicated.add(value)
+        del owners
+
+        seen = updated = 0
+        skipped = []
+        for chunk in chunked_queryset(queryset, options['batch_size']):
+            with transaction.atomic():
+                for pk, email, current in chunk:
+                    value = normalize_email(email) or None
+                    if value == current:
+                        continue
+                    if value in duplicated:
+                        skipped.append((pk, email))
+                        continue
+                    try:
+                        with transaction.atomic():
+                            user_model.objects.filter(pk=pk).update(normalized_email=value)
+                    except IntegrityError:  # Taken by a user saved meanwhile
+                        skipped.append((pk, email))
+                        continue
+                    updated += 1
+            seen += len(chunk)
+            self.stdout.write("%d users processed, %d updated" % (seen, updated))
+
+        for pk, email in skipped:
+            self.stdout.write("Skipped user %s: email %s is used by another user" % (pk, email))
+        if skipped:
+            self.stdout.write("%d users skipped, change their emails and run this command again" % len(skipped))
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher
+
+from base_accounts.utils import chunked_queryset
+
+
+def describe(encoded):
+    """
+    Return ``(algorithm, parameters)`` of an encoded password
+    """
+    if not encoded or encoded.startswith('!'):
+        return 'unusable', ''
+    parts = encoded.split('$')
+    if len(parts) == 1:
+        return 'unknown', ''
+    algorithm = parts[0]
+    if algorithm.startswith('pbkdf2'):
+        return algorithm, 'iterations=%s' % parts[1]
+    if algorithm.startswith('bcrypt') and len(parts) > 3:
+        return algorithm, 'rounds=%s' % parts[3]
+    if algorithm == 'argon2' and len(parts) > 3:
+        return algorithm, parts[3]
+    return algorithm, ''
+
+
+class Command(NoArgsCommand):
+    help = "Report how many users have each password hash algorithm and work factor"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=5000,
+                    help='Number of users read at a time'),
+    )
+
+    def handle_noargs(self, **options):
+        counts = defaultdict(int)
+        queryset = get_user_model().objects.values_list('pk', 'password')
+        for chunk in chunked_queryset(queryset, options['batch_size']):
+            for pk, encoded in chunk:
+                counts[describe(encoded)] += 1
+
+        hasher = get_hasher()
+        current = hasher.algorithm, ('iterations=%s' % hasher.iterations if hasattr(hasher, 'iterations') else '')
+        total = sum(counts.values())
+        for (algorithm, parameters), count in sorted(counts.items(), key=lambda item: -item[1]):
+            marker = ' (current)' if (algorithm, parameters) == current else ''
+            self.stdout.write("%-20s %-30s %10d %6.2f%%%s" % (
+                algorithm, parameters, count, 100.0 * count / total, marker))
+        self.stdout.write("%d users" % total)
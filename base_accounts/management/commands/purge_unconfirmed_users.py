@@ -0,0 +1,38 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.utils.timezone import now
+
+from base_accounts.bulk import purge_unconfirmed_users
+
+
+class Command(NoArgsCommand):
+    help = "Delete users who never confirmed their email address"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=30,
+                    help='Purge users who joined more than this many days ago'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of users purged per transaction'),
+        make_option('--sleep', type='float', dest='sleep', default=0,
+                    help='Seconds to wait between batches'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count the users that would be purged'),
+        make_option('--deactivate', action='store_true', dest='deactivate', default=False,
+                    help='Deactivate users instead of deleting them'),
+    )
+
+    def handle_noargs(self, **options):
+        purged = purge_unconfirmed_users(
+            now() - timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+            deactivate=options['deactivate'],
+            progress=lambda count: self.stdout.write("%d users processed" % count),
+        )
+        action = 'deactivated' if options['deactivate'] else 'deleted'
+        if options['dry_run']:
+            self.stdout.write("%d users would be %s" % (purged, action))
+        else:
+            self.stdout.write("%d users %s" % (purged, action))
@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from base_accounts.mail import send_pending_confirmations
+
+
+class Command(NoArgsCommand):
+    help = "Send queued email address confirmation messages"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of users read and dequeued at a time'),
+        make_option('--retries', type='int', dest='retries', default=3,
+                    help='Retries for each failed message'),
+        make_option('--backoff', type='float', dest='backoff', default=1,
+                    help='Seconds to wait before the first retry, doubled on each one'),
+        make_option('--language', dest='language', default=None,
+                    help='Language of the messages, LANGUAGE_CODE by default'),
+    )
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        sent = send_pending_confirmations(
+            batch_size=options['batch_size'],
+            retries=options['retries'],
+            backoff=options['backoff'],
+            language=options['language'],
+        )
+        elapsed = time.time() - start
+        self.stdout.write("%d messages sent, %.1f messages/second" % (sent, sent / elapsed if elapsed else sent))
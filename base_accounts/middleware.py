@@ -0,0 +1,41 @@
+from django.conf import settings
+
+from base_accounts import db
+from base_accounts.views import LoginFormView
+
+
+class PrimaryPinningMiddleware(object):
+    """
+    Pins account reads to the primary database for clients that recently
+    wrote to their user, tracked with a short lived cookie. Pins within a
+    request are cleared by ``base_accounts.db`` without this middleware.
+    """
+    cookie_name = 'base_accounts_pin'
+
+    def process_request(self, request):
+        if self.cookie_name in request.COOKIES:
+            db.pin_to_primary()
+
+    def process_response(self, request, response):
+        if getattr(db._local, 'wrote', False):
+            response.set_cookie(self.cookie_name, '1', max_age=getattr(settings, 'BASE_ACCOUNTS_PRIMARY_PIN_SECONDS', 5))
+        return response
+
+
+class LoginMessageMiddleware(object):
+    """
+    Reads the cookie set by ``LoginFormView`` when
+    ``BASE_ACCOUNTS_LOGIN_MESSAGE_COOKIE`` is enabled, exposing its success
+    message as ``request.login_message`` for one request, and deletes it
+    """
+
+    def process_request(self, request):
+        cookie_name = getattr(settings, 'BASE_ACCOUNTS_LOGIN_MESSAGE_COOKIE', None)
+        request.login_message = None
+        if cookie_name and request.COOKIES.get(cookie_name):
+            request.login_message = LoginFormView.success_message
+
+    def process_response(self, request, response):
+        if getattr(request, 'login_message', None) is not None:
+            response.delete_cookie(settings.BASE_ACCOUNTS_LOGIN_MESSAGE_COOKIE)
+        return response
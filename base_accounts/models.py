@@ -1,32 +1,130 @@
 from django.db import models
+from django.conf import settings
 from django.core import signing
+from django.contrib.auth import models as auth_models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 
+from base_accounts import session_index
+
 
 class BaseUser(AbstractUser):
-    slug = models.SlugField(_('slug'), max_length=255)
+    slug = models.SlugField(_('slug'), max_length=255, unique=getattr(settings, 'BASE_ACCOUNTS_UNIQUE_SLUG', False))
     name = models.CharField(_('name'), max_length=255, blank=True)
     first_login = models.BooleanField(_('first login'), default=True)
     image = models.ImageField(_('image'), blank=True, null=True, upload_to="images/avatars/%Y/%m/%d", max_length=255)
     confirmed = models.DateTimeField(null=True, blank=True)
+    confirmation_requested = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    normalized_email = models.EmailField(_('normalized email'), max_length=254, null=True, blank=True, editable=False, unique=True)
 
     class Meta:
         abstract = True
 
+    def __init__(self, *args, **kwargs):
+        super(BaseUser, self).__init__(*args, **kwargs)
+        # Slug as loaded, to tell whether a save changes it (None if deferred)
+        self._loaded_slug = self.__dict__.get('slug')
+
     def save(self, *args, **kwargs):
+        from base_accounts import auth_cache, avatars, db, email_filter, slugs
+        from base_accounts.utils import normalize_email
+        update_fields = kwargs.get('update_fields')
 
-        # Create slug from username. Although ``BaseUser.slug`` field is not
-        # unique at database level, it will be unique as long as
-        # ``AbstractUser.username`` stays unique as well.
-        if not self.id:
+        # Create slug from username. Unless ``BASE_ACCOUNTS_UNIQUE_SLUG`` is
+        # set, ``BaseUser.slug`` field is not unique at database level, but
+        # it will be unique as long as ``AbstractUser.username`` stays unique
+        # and slugifies to distinct values.
+        if not self.id and not self.slug:
             self.slug = slugify(self.username)
+            if getattr(settings, 'BASE_ACCOUNTS_UNIQUE_SLUG', False):
+                self.slug = self.get_unique_slug(self.slug)
+
+        # Keep an indexed, lowercased copy of the email so lookups can use
+        # an exact match instead of a case-insensitive scan.
+        email_changed = update_fields is None or 'email' in update_fields
+        if email_changed:
+            self.normalized_email = normalize_email(self.email) or None
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(['normalized_email'])
+
+        # Drop cached credentials when the password or email may have changed
+        if email_changed or 'password' in update_fields:
+            auth_cache.invalidate(self.normalized_email)
+
+        # Drop the cached resolution of a slug this user no longer has. New
+        # slugs need nothing, as cached entries are verified on use.
+        slug_changed = ((update_fields is None or 'slug' in update_fields) and 'slug' in self.__dict__ and
+                        self.slug != self._loaded_slug)
+        if slug_changed and self.id:
+            slugs.invalidate(self._loaded_slug)
+
+        # Files are committed to storage on save, so check for a new upload
+        # first. A deferred image cannot be a new upload, and reading it
+        # would load it with an extra query.
+        new_image = ((update_fields is None or 'image' in update_fields) and 'image' in self.__dict__ and
+                     bool(self.image) and not self.image._committed)
 
         super(BaseUser, self).save(*args, **kwargs)
+        db.mark_write()
+        if slug_changed:
+            self._loaded_slug = self.slug
+        if email_changed:
+            email_filter.add(self.normalized_email)
+        if new_image and avatars.enabled():
+            avatars.schedule(self.image.name)
+
+    def get_unique_slug(self, slug):
+        """
+        Return ``slug``, or ``slug`` plus the first free numeric suffix if
+        another user already has it
+        """
+        candidate, counter = slug, 2
+        while type(self)._default_manager.filter(slug=candidate).exists():
+            suffix = '-%d' % counter
+            candidate = slug[:255 - len(suffix)] + suffix
+            counter += 1
+        return candidate
+
+    def get_avatar_url(self, size, image_format='JPEG'):
+        """
+        URL of the ``size`` pixels rendition of ``image``, see
+        ``BASE_ACCOUNTS_AVATAR_SIZES``
+        """
+        from base_accounts.avatars import rendition_url
+        if not self.image:
+            return None
+        return rendition_url(self.image.name, size, image_format, self.image.storage)
 
     def get_display_name(self):
         return self.name or self.username
 
     def get_confirmation_token(self):
-        return signing.dumps(self.pk)
+        from base_accounts.utils import email_digest
+        # Sign a digest of the email along with the pk, so tokens issued for a
+        # previous address are rejected without exposing the address itself.
+        return signing.dumps([self.pk, email_digest(self.normalized_email)], salt='resend_email_confirmation')
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Like ``django.contrib.auth.models.update_last_login``, but skips the
+    UPDATE while the stored value is within
+    ``BASE_ACCOUNTS_LAST_LOGIN_RESOLUTION`` seconds
+    """
+    current = now()
+    resolution = getattr(settings, 'BASE_ACCOUNTS_LAST_LOGIN_RESOLUTION', None)
+    if user.last_login and resolution is not None and (current - user.last_login).total_seconds() < resolution:
+        return
+    user.last_login = current
+    user.save(update_fields=['last_login'])
+
+
+user_logged_in.connect(session_index.track_login)
+user_logged_out.connect(session_index.track_logout)
+
+if getattr(settings, 'BASE_ACCOUNTS_LAST_LOGIN_RESOLUTION', None) is not None:
+    user_logged_in.disconnect(auth_models.update_last_login)
+    user_logged_in.connect(update_last_login)
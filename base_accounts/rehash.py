@@ -0,0 +1,84 @@
+"""
+Deferred password hash upgrades.
+
+When ``BASE_ACCOUNTS_DEFERRED_REHASH`` is enabled, ``EmailBackend`` hands
+hashes that need upgrading to a background thread instead of rehashing on
+the login request. Pending upgrades are kept per user, so repeated logins
+queue a single one, and are applied only if the stored hash is unchanged.
+
+Upgrades are never deferred while ``SessionAuthenticationMiddleware`` is
+installed: ``login()`` stores a hash of the current password in the
+session, and changing it afterwards would log the user out.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+
+from base_accounts import auth_cache
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_pending = {}
+_thread = None
+
+
+SESSION_VERIFICATION_MIDDLEWARE = 'django.contrib.auth.middleware.SessionAuthenticationMiddleware'
+
+
+def enabled():
+    return (getattr(settings, 'BASE_ACCOUNTS_DEFERRED_REHASH', False) and
+            SESSION_VERIFICATION_MIDDLEWARE not in settings.MIDDLEWARE_CLASSES)
+
+
+def schedule(user, raw_password):
+    """
+    Queue an upgrade of ``user``'s password hash. Dropped if the queue is
+    full, as the next login will queue it again.
+    """
+    global _thread
+    with _lock:
+        if user.pk in _pending or len(_pending) >= getattr(settings, 'BASE_ACCOUNTS_DEFERRED_REHASH_QUEUE_SIZE', 1000):
+            return
+        _pending[user.pk] = (user.password, raw_password, user.normalized_email)
+        if _thread is None:
+            _thread = threading.Thread(target=_work, name='base_accounts-rehash')
+            _thread.daemon = True
+            _thread.start()
+    _wakeup.set()
+
+
+def upgrade(pk, old_password, raw_password, email=None):
+    """
+    Store a new hash of ``raw_password`` unless the password changed since
+    ``old_password`` was read. The queryset update skips ``BaseUser.save``,
+    so the cached credentials for ``email`` are dropped here.
+    """
+    users = get_user_model().objects.filter(pk=pk, password=old_password)
+    if users.update(password=make_password(raw_password)):
+        auth_cache.invalidate(email)
+
+
+def _work():
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        while True:
+            with _lock:
+                if not _pending:
+                    break
+                pk = next(iter(_pending))
+                args = _pending[pk]
+            try:
+                upgrade(pk, *args)
+            except Exception:
+                logger.exception("Could not upgrade password hash of user %s", pk)
+            finally:
+                with _lock:
+                    del _pending[pk]
+        connection.close()
@@ -0,0 +1,110 @@
+"""
+Per-user index of session keys.
+
+With ``BASE_ACCOUNTS_SESSION_INDEX`` enabled, the keys of a user's sessions
+are kept in Django's cache framework as logins and logouts happen, so all
+of them can be revoked without scanning the session store. Password and
+email updates revoke the user's other sessions.
+
+Each login takes the next slot of the user from a cache counter and claims
+it with an atomic ``add`` of its session key, so concurrent logins, logouts
+and revocations never overwrite each other's entries.
+"""
+from importlib import import_module
+
+from django.conf import settings
+
+from base_accounts.utils import get_cache
+
+SLOT_SESSION_KEY = '_base_accounts_session_slot'
+
+
+def enabled():
+    return getattr(settings, 'BASE_ACCOUNTS_SESSION_INDEX', False)
+
+
+def _cache():
+    return get_cache(getattr(settings, 'BASE_ACCOUNTS_SESSION_INDEX_ALIAS', 'default'))
+
+
+def _counter_key(user):
+    return 'base_accounts:sessions:%s' % user.pk
+
+
+def _slot_key(user, slot):
+    return 'base_accounts:sessions:%s:%s' % (user.pk, slot)
+
+
+def _next_counter(user):
+    cache, key = _cache(), _counter_key(user)
+    try:
+        return cache.incr(key)
+    except ValueError:  # No counter yet
+        if cache.add(key, 1, None):
+            return 1
+        return cache.incr(key)
+
+
+def _claim_slot(user, session_key):
+    """
+    Store ``session_key`` in the next free slot of ``user`` and return it.
+    Slots are claimed with ``add``, as ``incr`` is not atomic on every
+    backend, e.g. ``locmem`` on older Django versions.
+    """
+    while True:
+        slot = _next_counter(user)
+        if _cache().add(_slot_key(user, slot), session_key, settings.SESSION_COOKIE_AGE):
+            return slot
+
+
+def _slot_keys(user):
+    """
+    Cache keys of the most recent slots of ``user``
+    """
+    last = _cache().get(_counter_key(user)) or 0
+    first = max(1, last - getattr(settings, 'BASE_ACCOUNTS_SESSION_INDEX_SIZE', 100) + 1)
+    return [_slot_key(user, slot) for slot in range(first, last + 1)]
+
+
+def get_session_keys(user):
+    slots = _cache().get_many(_slot_keys(user))
+    return [slots[key] for key in sorted(slots, key=lambda key: int(key.rsplit(':', 1)[1]))]
+
+
+def track_login(sender, request, user, **kwargs):
+    """
+    ``user_logged_in`` receiver adding the new session to the index
+    """
+    session_key = request.session.session_key
+    if not enabled() or session_key is None:
+        return
+    previous = request.session.get(SLOT_SESSION_KEY)
+    if previous is not None:  # Logging in again within the same session
+        _cache().delete(_slot_key(user, previous))
+    request.session[SLOT_SESSION_KEY] = _claim_slot(user, session_key)
+
+
+def track_logout(sender, request, user, **kwargs):
+    """
+    ``user_logged_out`` receiver removing the session from the index
+    """
+    slot = request.session.get(SLOT_SESSION_KEY)
+    if not enabled() or user is None or slot is None:
+        return
+    _cache().delete(_slot_key(user, slot))
+
+
+def revoke_sessions(user, keep=None):
+    """
+    Delete every indexed session of ``user`` except ``keep`` and return how
+    many were deleted
+    """
+    if not enabled():
+        return 0
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    slots = _cache().get_many(_slot_keys(user))
+    revoked = [key for key, session_key in slots.items() if session_key != keep]
+    for key in revoked:
+        store.delete(slots[key])
+    _cache().delete_many(revoked)
+    return len(revoked)
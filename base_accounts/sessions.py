@@ -0,0 +1,60 @@
+"""
+Database session engine writing each login once.
+
+``django.contrib.auth.login`` rotates the session key with ``cycle_key``,
+which inserts a new row right away and deletes the previous one, before the
+session middleware saves the logged in session again. With
+``SESSION_ENGINE = 'base_accounts.sessions'`` the new key is only picked on
+rotation, and stored along with the session data by the middleware save, by
+updating the previous row or inserting a new one.
+"""
+from django.contrib.sessions.backends import db
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.models import Session
+from django.db import router
+
+
+class SessionStore(db.SessionStore):
+
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(session_key)
+        self._key_pending = False
+        self._previous_key = None
+
+    def cycle_key(self):
+        """
+        Create a new session key, saved with the session data on the next save
+        """
+        data = self._get_session()
+        if not self._key_pending:
+            self._key_pending = True
+            self._previous_key = self.session_key
+        self._session_key = self._get_new_session_key()
+        self._session_cache = data
+        self.modified = True
+
+    def flush(self):
+        if self._key_pending:
+            self._key_pending = False
+            self._session_key = self._previous_key
+        super(SessionStore, self).flush()
+
+    def save(self, must_create=False):
+        if must_create or not self._key_pending:
+            return super(SessionStore, self).save(must_create)
+        self._key_pending = False
+
+        # Move the previous row to the new key
+        if self._previous_key is not None:
+            sessions = Session.objects.using(router.db_for_write(Session))
+            if sessions.filter(session_key=self._previous_key).update(
+                session_key=self.session_key,
+                session_data=self.encode(self._get_session(no_load=True)),
+                expire_date=self.get_expiry_date(),
+            ):
+                return
+
+        try:
+            super(SessionStore, self).save(must_create=True)
+        except CreateError:
+            self.create()
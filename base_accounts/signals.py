@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by ``instrumentation.Timer`` for every timed phase of authentication,
+# login and signup. ``outcome`` is None or a short string such as ``'miss'``.
+auth_phase = Signal(providing_args=['operation', 'phase', 'duration', 'outcome'])
@@ -0,0 +1,55 @@
+"""
+Cached resolution of user slugs.
+
+Maps a slug to the user primary key in Django's cache framework, so
+profile routing only needs a primary key lookup. Entries are verified on
+use, and dropped when ``BaseUser.save`` changes the slug they resolve.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from base_accounts.utils import get_cache
+
+
+def _cache():
+    return get_cache(getattr(settings, 'BASE_ACCOUNTS_SLUG_CACHE_ALIAS', 'default'))
+
+
+def _key(slug):
+    return 'base_accounts:slug:%s' % hashlib.sha1(slug.encode('utf-8')).hexdigest()
+
+
+def get_user_pk(slug):
+    """
+    Return the primary key of the user with ``slug``, or None
+    """
+    key = _key(slug)
+    pk = _cache().get(key)
+    if pk is None:
+        pk = get_user_model()._default_manager.filter(slug=slug).values_list('pk', flat=True).first()
+        if pk is not None:
+            _cache().set(key, pk, getattr(settings, 'BASE_ACCOUNTS_SLUG_CACHE_TIMEOUT', 3600))
+    return pk
+
+
+def get_user(slug, queryset=None):
+    """
+    Return the user with ``slug`` from ``queryset`` (all users by default),
+    raising ``DoesNotExist`` as ``QuerySet.get`` would
+    """
+    user_model = get_user_model()
+    queryset = queryset if queryset is not None else user_model._default_manager.all()
+    pk = get_user_pk(slug)
+    if pk is not None:
+        try:
+            return queryset.get(pk=pk, slug=slug)
+        except user_model.DoesNotExist:
+            invalidate(slug)  # Stale entry, fall back to the slug lookup
+    return queryset.get(slug=slug)
+
+
+def invalidate(slug):
+    if slug:
+        _cache().delete(_key(slug))
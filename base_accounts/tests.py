@@ -0,0 +1,900 @@
+import re
+import smtplib
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib import admin
+from django.core import mail as outbox, signing
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+from base_accounts import (auth_cache, bulk, db, email_filter, instrumentation, mail, rehash, session_index, slugs,
+                           throttling, utils)
+from base_accounts.admin import ExportUsersMixin
+from base_accounts.auth_backend import EmailBackend
+from base_accounts.sessions import SessionStore
+from base_accounts.forms import LoginForm, SignupForm
+from base_accounts.management.commands.benchmark_accounts import CaptureAllQueries
+from base_accounts.models import BaseUser
+from base_accounts.signals import auth_phase
+from base_accounts.utils import UserAlreadyExists, create_email_user, random_username
+from base_accounts.views import LoginFormView, SignupFormView
+
+
+class User(BaseUser):
+    """Concrete user model for tests, see ``test_settings.AUTH_USER_MODEL``"""
+
+    class Meta:
+        app_label = 'base_accounts'
+
+
+def colliding_username(email, attempt):
+    """Username allocator whose first candidate is always taken"""
+    return 'taken' if attempt == 0 else random_username(email, attempt)
+
+
+def user_queries(captured):
+    """SQL of the captured queries touching the user table"""
+    return [query['sql'] for query in captured.captured_queries if '"base_accounts_user"' in query['sql']]
+
+
+def session_writes(captured):
+    """Captured statements writing to the session table"""
+    return [query['sql'] for query in captured.captured_queries
+            if '"django_session"' in query['sql'] and re.search(r'\b(INSERT|UPDATE|DELETE)\b', query['sql'])]
+
+
+def updated_columns(sql):
+    """Columns set by an UPDATE statement"""
+    return set(re.findall(r'"(\w+)" = ', sql.split(' SET ', 1)[1].split(' WHERE ', 1)[0]))
+
+
+class AccountViewQueriesTests(TestCase):
+    """Account views run a fixed number of user queries and write only the columns they change"""
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret', name='john')
+        self.client.login(email='john@example.com', password='secret')
+
+    def post(self, name, data=None, method='post'):
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(name if name.startswith('/') else reverse(name), data or {})
+        self.assertEqual(response.status_code, 302)
+        return user_queries(captured)
+
+    def test_signup(self):
+        # Existence probe, insert, last login update
+        self.client.logout()
+        queries = self.post('signup', {
+            'full_name': 'Jane', 'email': 'jane@example.com', 'password': 'secret', 'tos': 'on'})
+        self.assertEqual(len(queries), 3)
+        self.assertIn('INSERT INTO', queries[1])
+        self.assertEqual(updated_columns(queries[2]), set(['last_login']))
+
+    def test_update_email(self):
+        # Session user, existence probe, update
+        queries = self.post('settings_update_email', {'email': 'new@example.com'})
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(updated_columns(queries[2]), set(['email', 'confirmed', 'normalized_email']))
+
+    def test_update_password(self):
+        # Session user, update
+        queries = self.post('settings_update_password', {'password1': 'new', 'password2': 'new'})
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(updated_columns(queries[1]), set(['password']))
+
+    def test_confirm_email_address(self):
+        # Session user, conditional update
+        url = reverse('confirm_email_address', kwargs={'token': self.user.get_confirmation_token()})
+        queries = self.post(url, method='get')
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(updated_columns(queries[1]), set(['confirmed']))
+        self.assertIn('"confirmed" IS NULL', queries[1])
+
+    def test_logout(self):
+        # Session user, update
+        queries = self.post('logout', method='get')
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(updated_columns(queries[1]), set(['first_login']))
+
+    def test_update_email_taken(self):
+        # Session user, existence probe
+        create_email_user('jane@example.com', 'secret')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('settings_update_email'), {'email': 'jane@example.com'})
+        self.assertEqual(len(user_queries(captured)), 2)
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'john@example.com')
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(BASE_ACCOUNTS_USER_DEFER_FIELDS=('image', 'name'))
+    def test_logout_deferred_fields(self):
+        # Session user, update, without loading the deferred image
+        queries = self.post('logout', method='get')
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(updated_columns(queries[1]), set(['first_login']))
+
+    def test_save_deferred_image(self):
+        user = User.objects.defer('image').get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as captured:
+            user.save(update_fields=['first_login'])
+            user.save()
+        self.assertEqual(len(user_queries(captured)), 2)
+
+    def test_save_keeps_slug(self):
+        self.user.username = 'other'
+        self.user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).slug, self.user.slug)
+
+
+class SlugTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='john', email='john@example.com')
+
+    def tearDown(self):
+        slugs._cache().clear()
+
+    def cached_pk(self, slug):
+        return slugs._cache().get(slugs._key(slug))
+
+    @override_settings(BASE_ACCOUNTS_UNIQUE_SLUG=True)
+    def test_unique_suffix(self):
+        users = [User.objects.create(username=username, email='%s@example.com' % i)
+                 for i, username in enumerate(['John!', 'john.'])]
+        self.assertEqual([user.slug for user in users], ['john-2', 'john-3'])
+        self.assertEqual(slugs.get_user('john-3'), users[1])
+
+    def test_cached_resolution(self):
+        self.assertEqual(slugs.get_user('john'), self.user)
+        self.assertEqual(self.cached_pk('john'), self.user.pk)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(slugs.get_user('john'), self.user)
+        self.assertEqual(len(captured), 1)
+
+    def test_stale_entry(self):
+        slugs.get_user('john')
+        User.objects.filter(pk=self.user.pk).update(slug='john-old')
+        other = User.objects.create(username='other', email='other@example.com', slug='john')
+        self.assertEqual(slugs.get_user('john'), other)
+        self.assertIsNone(self.cached_pk('john'))
+        self.assertRaises(User.DoesNotExist, slugs.get_user, 'john', User.objects.exclude(pk=other.pk))
+
+    def test_save_invalidates_changed_slug(self):
+        slugs.get_user('john')
+        invalidated = []
+        self.addCleanup(setattr, slugs, 'invalidate', slugs.invalidate)
+        slugs.invalidate = lambda slug, invalidate=slugs.invalidate: invalidated.append(slug) or invalidate(slug)
+        user = User.objects.get(pk=self.user.pk)
+        user.name = 'john'
+        user.save()
+        User.objects.defer('slug').get(pk=self.user.pk).save()
+        self.assertEqual(invalidated, [])
+        user.slug = 'johnny'
+        user.save()
+        user.save()
+        self.assertEqual(invalidated, ['john'])
+        self.assertIsNone(self.cached_pk('john'))
+
+
+class ConfirmationTokenTests(TestCase):
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret')
+
+    def confirm(self, token):
+        return self.client.get(reverse('confirm_email_address', kwargs={'token': token}))
+
+    def test_token_hides_email(self):
+        token = self.user.get_confirmation_token()
+        self.assertNotIn('john', signing.b64_decode(token.split(':')[0].encode('ascii')).decode('utf-8'))
+        self.assertEqual(self.confirm(token).status_code, 302)
+        self.assertIsNotNone(User.objects.get().confirmed)
+        self.assertEqual(self.confirm(token).status_code, 404)
+
+    def test_rejects_token_for_previous_email(self):
+        token = self.user.get_confirmation_token()
+        self.user.email = 'new@example.com'
+        self.user.save(update_fields=['email'])
+        self.assertEqual(self.confirm(token).status_code, 404)
+        self.assertIsNone(User.objects.get().confirmed)
+
+    def test_legacy_token(self):
+        token = signing.dumps(self.user.pk, salt='resend_email_confirmation')
+        self.assertEqual(self.confirm(token).status_code, 302)
+        self.assertIsNotNone(User.objects.get().confirmed)
+
+
+class UnnormalizedEmailTests(TestCase):
+    """Users not backfilled by ``normalize_emails`` yet can log in and keep their email"""
+
+    def setUp(self):
+        create_email_user('John@Example.com', 'secret')
+        create_email_user('jane@example.com', 'secret')
+        User.objects.update(normalized_email=None)
+        utils._unnormalized['exists'] = None
+
+    def tearDown(self):
+        utils._unnormalized['exists'] = None
+
+    def normalize_emails(self):
+        out = StringIO()
+        call_command('normalize_emails', batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_login(self):
+        self.assertIsNotNone(authenticate(email='john@example.com', password='secret'))
+
+    def test_signup_rejects_taken_email(self):
+        self.assertRaises(UserAlreadyExists, create_email_user, 'JOHN@example.com', 'secret')
+        form = SignupForm({'full_name': 'John', 'email': 'john@EXAMPLE.com', 'password': 'p', 'tos': 'on'})
+        self.assertIn('email', form.errors)
+
+    def test_backfill(self):
+        self.normalize_emails()
+        self.assertEqual(sorted(User.objects.values_list('normalized_email', flat=True)),
+                         ['jane@example.com', 'john@example.com'])
+        utils._unnormalized['exists'] = None
+        self.assertFalse(utils.unnormalized_emails_exist())
+
+    def test_backfill_skips_case_duplicates(self):
+        User.objects.create(username='other', email='JANE@example.com')
+        User.objects.update(normalized_email=None)
+        out = self.normalize_emails()
+        self.assertIn('2 users skipped', out)
+        self.assertEqual(list(User.objects.exclude(normalized_email=None).values_list('normalized_email', flat=True)),
+                         ['john@example.com'])
+        self.assertTrue(utils.unnormalized_emails_exist())
+
+
+class SignupRaceTests(TestCase):
+    """An email taken between form validation and save is a form error"""
+
+    def setUp(self):
+        create_email_user('jane@example.com', 'secret')
+        self.clean_email = SignupForm.clean_email
+        SignupForm.clean_email = lambda form: form.cleaned_data['email']
+
+    def tearDown(self):
+        SignupForm.clean_email = self.clean_email
+
+    def test_email_taken_after_clean(self):
+        request = RequestFactory().post(reverse('signup'), {
+            'full_name': 'Jane', 'email': 'jane@example.com', 'password': 'secret', 'tos': 'on'})
+        response = SignupFormView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('email', response.context_data['form'].errors)
+        self.assertEqual(User.objects.filter(normalized_email='jane@example.com').count(), 1)
+
+
+@override_settings(
+    SESSION_ENGINE='base_accounts.sessions',
+    MESSAGE_STORAGE='django.contrib.messages.storage.session.SessionStorage',
+    BASE_ACCOUNTS_LOGIN_MESSAGE_COOKIE='welcome',
+    MIDDLEWARE_CLASSES=settings.MIDDLEWARE_CLASSES + ('base_accounts.middleware.LoginMessageMiddleware',),
+)
+class LoginSessionTests(TestCase):
+    """A login writes the session once and flags its message in a cookie"""
+
+    def setUp(self):
+        create_email_user('john@example.com', 'secret')
+
+    def login(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('login'), {'email': 'john@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        return session_writes(captured)
+
+    def test_new_session(self):
+        self.assertEqual(len(self.login()), 1)
+        # Django 1.8 stores the pk as a string, 1.7 as is
+        self.assertEqual(str(self.client.session['_auth_user_id']), str(User.objects.get().pk))
+
+    def test_existing_session(self):
+        store = SessionStore()
+        store['cart'] = 'full'
+        store.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = store.session_key
+        self.assertEqual(len(self.login()), 1)
+        self.assertNotEqual(self.client.session.session_key, store.session_key)
+        self.assertEqual(self.client.session['cart'], 'full')
+        self.assertFalse(SessionStore().exists(store.session_key))
+
+    def test_message_cookie_read_once(self):
+        self.login()
+        self.assertIn('welcome', self.client.cookies)
+        response = self.client.get(reverse('logout'))
+        self.assertEqual(response.wsgi_request.login_message, LoginFormView.success_message)
+        self.assertEqual(response.cookies['welcome']['max-age'], 0)
+        response = self.client.get(reverse('logout'))
+        self.assertIsNone(response.wsgi_request.login_message)
+
+
+class FakeClock(object):
+    """Stand-in for the ``time`` module with a settable clock"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@override_settings(BASE_ACCOUNTS_LOGIN_THROTTLE=(3, 100))
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        create_email_user('john@example.com', 'secret')
+        self.clock = FakeClock(1000)
+        self.addCleanup(setattr, throttling, 'time', throttling.time)
+        self.addCleanup(setattr, throttling, '_local_store', None)
+        throttling.time = self.clock
+        throttling._local_store = None
+
+    def keys(self, email, ip):
+        request = RequestFactory().post('/', REMOTE_ADDR=ip)
+        return throttling.login_keys(request, email)
+
+    def fail(self, email, ip, times=1):
+        for i in range(times):
+            throttling.record_failure(self.keys(email, ip))
+
+    def test_sliding_window(self):
+        self.fail('john@example.com', '10.0.0.1', 2)
+        self.assertFalse(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+        self.fail('john@example.com', '10.0.0.1')
+        self.assertTrue(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+        # Half of the previous window is still in range: 3 * .5 failures
+        self.clock.now = 1150
+        self.assertFalse(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+        self.fail('john@example.com', '10.0.0.1', 2)
+        self.assertTrue(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+        # Only the 2 failures of the previous window count, by half
+        self.clock.now = 1250
+        self.assertFalse(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+
+    def test_email_scope(self):
+        self.fail('John@Example.com', '10.0.0.1')
+        self.fail('john@example.com', '10.0.0.2')
+        self.fail('john@example.com ', '10.0.0.3')
+        self.assertTrue(throttling.is_throttled(self.keys('john@example.com', '10.0.0.4')))
+        self.assertFalse(throttling.is_throttled(self.keys('jane@example.com', '10.0.0.4')))
+
+    def test_ip_scope(self):
+        for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+            self.fail(email, '10.0.0.1')
+        self.assertTrue(throttling.is_throttled(self.keys('john@example.com', '10.0.0.1')))
+        self.assertFalse(throttling.is_throttled(self.keys('john@example.com', '10.0.0.2')))
+
+    def login_form(self, password, ip='10.0.0.1'):
+        request = RequestFactory().post('/', REMOTE_ADDR=ip)
+        return LoginForm({'email': 'john@example.com', 'password': password}, request=request)
+
+    def test_throttled_login_skips_authentication(self):
+        self.fail('john@example.com', '10.0.0.2', 3)
+        form = self.login_form('secret')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertFalse(form.is_valid())
+        self.assertIn('Too many failed login attempts', str(form.errors))
+        self.assertEqual(user_queries(captured), [])
+
+    def test_failed_logins_counted(self):
+        for i in range(3):
+            self.assertFalse(self.login_form('wrong').is_valid())
+        self.assertTrue(throttling.is_throttled(self.keys('john@example.com', '10.0.0.2')))
+        self.assertTrue(throttling.is_throttled(self.keys('jane@example.com', '10.0.0.1')))
+
+    def test_local_store_evicts_least_recently_used(self):
+        store = throttling.LocalCounterStore(max_entries=2)
+        store.incr('a', 100)
+        store.incr('b', 100)
+        store.incr('a', 100)
+        store.incr('c', 100)
+        self.assertEqual(store.get_many(['a', 'b', 'c']), {'a': 2, 'c': 1})
+
+    def test_local_store_expiry(self):
+        store = throttling.LocalCounterStore()
+        store.incr('a', 100)
+        self.clock.now = 1100
+        self.assertEqual(store.get_many(['a']), {})
+        store.incr('a', 100)
+        self.assertEqual(store.get_many(['a']), {'a': 1})
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000)
+        self.addCleanup(setattr, instrumentation, 'time', instrumentation.time)
+        instrumentation.time = self.clock
+
+    def receive(self, exporter, dispatch_uid):
+        """Send two phases of a failed login through ``exporter``"""
+        exporter.connect()
+        self.addCleanup(auth_phase.disconnect, dispatch_uid=dispatch_uid)
+        timer = instrumentation.Timer('login')
+        self.clock.now += .25
+        timer.phase('throttle')
+        self.clock.now += .5
+        timer.phase('authenticate', 'failed')
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        exporter = instrumentation.StatsdExporter(*server.getsockname(), prefix='accounts')
+        self.receive(exporter, 'base_accounts.statsd')
+        self.assertEqual(server.recv(512), b'accounts.login.throttle:250.000|ms')
+        self.assertEqual(server.recv(512), b'accounts.login.authenticate:500.000|ms\n'
+                                           b'accounts.login.authenticate.failed:1|c')
+
+    def test_prometheus(self):
+        exporter = instrumentation.PrometheusExporter()
+        self.receive(exporter, 'base_accounts.prometheus')
+        self.receive(exporter, 'base_accounts.prometheus')
+        self.assertEqual(exporter.render(), '\n'.join([
+            '# TYPE base_accounts_phase_seconds summary',
+            'base_accounts_phase_seconds_sum{operation="login",phase="authenticate"} 1.000000',
+            'base_accounts_phase_seconds_count{operation="login",phase="authenticate"} 2',
+            'base_accounts_phase_seconds_sum{operation="login",phase="throttle"} 0.500000',
+            'base_accounts_phase_seconds_count{operation="login",phase="throttle"} 2',
+            '# TYPE base_accounts_outcomes_total counter',
+            'base_accounts_outcomes_total{operation="login",phase="authenticate",outcome="failed"} 2',
+        ]) + '\n')
+
+    def test_no_receivers(self):
+        sent = []
+        self.addCleanup(setattr, auth_phase, 'send', auth_phase.send)
+        auth_phase.send = lambda *args, **kwargs: sent.append(kwargs)
+        self.assertFalse(auth_phase.receivers)
+        create_email_user('john@example.com', 'secret')
+        form = LoginForm({'email': 'john@example.com', 'password': 'wrong'}, request=RequestFactory().post('/'))
+        self.assertFalse(form.is_valid())
+        self.assertEqual(sent, [])
+
+
+@override_settings(BASE_ACCOUNTS_AUTH_CACHE=True)
+class AuthCacheTests(TestCase):
+    """Cached credentials never outlive the password or email they were read with"""
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret')
+        self.assertIsNotNone(authenticate(email='john@example.com', password='secret'))
+        self.assertEqual(auth_cache.get_credentials('john@example.com'), (self.user.pk, self.user.password))
+
+    def tearDown(self):
+        auth_cache._cache().clear()
+
+    def test_wrong_password_without_user_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertIsNone(EmailBackend().authenticate(email='John@Example.com', password='wrong'))
+        self.assertEqual(user_queries(captured), [])
+
+    def test_password_update_invalidates(self):
+        self.user.set_password('new')
+        self.user.save(update_fields=['password'])
+        self.assertIsNone(auth_cache.get_credentials('john@example.com'))
+        self.assertIsNone(authenticate(email='john@example.com', password='secret'))
+        self.assertIsNotNone(authenticate(email='john@example.com', password='new'))
+
+    def test_email_update_invalidates_old_email(self):
+        self.client.login(email='john@example.com', password='secret')
+        self.client.post(reverse('settings_update_email'), {'email': 'new@example.com'})
+        self.assertIsNone(auth_cache.get_credentials('john@example.com'))
+        self.assertIsNone(authenticate(email='john@example.com', password='secret'))
+        self.assertIsNotNone(authenticate(email='new@example.com', password='secret'))
+
+    def test_stale_hash_rechecked(self):
+        # Password changed without BaseUser.save: the old one matches the
+        # cached hash only
+        User.objects.filter(pk=self.user.pk).update(password=make_password('new'))
+        self.assertIsNone(authenticate(email='john@example.com', password='secret'))
+        self.assertIsNone(auth_cache.get_credentials('john@example.com'))
+        self.assertIsNotNone(authenticate(email='john@example.com', password='new'))
+
+    def test_stale_hash_same_password(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password('secret'))
+        user = authenticate(email='john@example.com', password='secret')
+        self.assertEqual(user.password, User.objects.get(pk=self.user.pk).password)
+        self.assertIsNone(auth_cache.get_credentials('john@example.com'))
+
+
+class DeferredRehashTests(TestCase):
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret')
+
+    @override_settings(BASE_ACCOUNTS_DEFERRED_REHASH=True)
+    def test_not_deferred_with_session_verification(self):
+        self.assertFalse(rehash.enabled())
+        middleware = [m for m in settings.MIDDLEWARE_CLASSES if m != rehash.SESSION_VERIFICATION_MIDDLEWARE]
+        with self.settings(MIDDLEWARE_CLASSES=middleware):
+            self.assertTrue(rehash.enabled())
+
+    @override_settings(BASE_ACCOUNTS_AUTH_CACHE=True)
+    def test_upgrade_invalidates_auth_cache(self):
+        auth_cache.set_credentials(self.user)
+        rehash.upgrade(self.user.pk, self.user.password, 'secret', self.user.normalized_email)
+        self.assertIsNone(auth_cache.get_credentials(self.user.normalized_email))
+        self.assertNotEqual(User.objects.get(pk=self.user.pk).password, self.user.password)
+
+
+@override_settings(BASE_ACCOUNTS_READ_DATABASE='replica')
+class ReadRoutingTests(TestCase):
+    """Lookups read from the replica unless pinned to the primary by a write"""
+    multi_db = True
+
+    def setUp(self):
+        create_email_user('john@example.com', 'secret')
+        db.reset()
+
+    def tearDown(self):
+        db.reset()
+
+    def exists(self):
+        return db.for_read(User).filter(normalized_email='john@example.com').exists()
+
+    def test_reads_replica(self):
+        self.assertFalse(self.exists())
+
+    def test_write_pins_to_primary(self):
+        db.mark_write()
+        self.assertTrue(self.exists())
+
+    def test_benchmark_counts_replica_queries(self):
+        with CaptureAllQueries() as captured:
+            self.exists()
+            User.objects.count()
+        self.assertEqual(len(captured), 2)
+
+    @override_settings(BASE_ACCOUNTS_AUTH_CACHE=True)
+    def test_replica_rows_not_cached(self):
+        user = User.objects.get()
+        stale = User(pk=user.pk, username=user.username, email=user.email)
+        stale.set_password('old')
+        stale.save(using='replica')
+        db.reset()
+        self.addCleanup(auth_cache.invalidate, 'john@example.com')
+        self.assertIsNotNone(authenticate(email='john@example.com', password='old'))
+        self.assertIsNone(auth_cache.get_credentials('john@example.com'))
+        db.pin_to_primary()
+        self.assertIsNotNone(authenticate(email='john@example.com', password='secret'))
+        self.assertEqual(auth_cache.get_credentials('john@example.com'), (user.pk, user.password))
+
+    def test_pin_cleared_by_request(self):
+        db.mark_write()
+        self.client.get(reverse('logout'))
+        self.assertFalse(self.exists())
+
+
+class FlakyBackend(LocmemBackend):
+    """Refuses ``refused@example.com`` and fails once on ``flaky@example.com``"""
+
+    def __init__(self, *args, **kwargs):
+        super(FlakyBackend, self).__init__(*args, **kwargs)
+        self.failed = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to == ['refused@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'refused@example.com': (550, 'No such user')})
+            if message.to == ['flaky@example.com'] and not self.failed:
+                self.failed = True
+                raise smtplib.SMTPServerDisconnected()
+        return super(FlakyBackend, self).send_messages(messages)
+
+
+@override_settings(BASE_ACCOUNTS_SITE_URL='http://example.com')
+class ConfirmationMailTests(TestCase):
+
+    def setUp(self):
+        for email in ('a@example.com', 'refused@example.com', 'flaky@example.com', 'b@example.com'):
+            create_email_user(email, 'secret', confirmation_requested=now())
+
+    def test_each_message_sent_once(self):
+        sent = mail.send_pending_confirmations(batch_size=10, backoff=0, connection=FlakyBackend())
+        self.assertEqual(sent, 3)
+        self.assertEqual(sorted(message.to[0] for message in outbox.outbox),
+                         ['a@example.com', 'b@example.com', 'flaky@example.com'])
+        self.assertFalse(User.objects.exclude(confirmation_requested=None).exists())
+
+    def test_dequeues_sent_messages_on_failure(self):
+        self.assertRaises(smtplib.SMTPServerDisconnected, mail.send_pending_confirmations,
+                          batch_size=10, retries=0, connection=FlakyBackend())
+        self.assertEqual(set(User.objects.exclude(confirmation_requested=None).values_list('email', flat=True)),
+                         set(['flaky@example.com', 'b@example.com']))
+
+    def test_translated(self):
+        user = User.objects.get(email='a@example.com')
+        user.name = 'Ana'
+        message = mail.build_message(user, 'es')
+        self.assertEqual(message.subject, u'Por favor confirma tu direcci\xf3n de email')
+        self.assertTrue(message.body.startswith(u'Hola Ana,\n\nPor favor confirma tu direcci\xf3n de email siguiendo'))
+        self.assertIn('http://example.com' + reverse('confirm_email_address', kwargs={'token': user.get_confirmation_token()}),
+                      message.body)
+        message = mail.build_message(user, 'en')
+        self.assertEqual(message.subject, 'Please confirm your email address')
+        self.assertTrue(message.body.startswith('Hi Ana,\n\nPlease confirm'))
+
+
+class BulkCreateTests(TestCase):
+
+    def setUp(self):
+        create_email_user('John@Example.com', 'secret')
+
+    def test_skips_repeated_and_existing_emails(self):
+        rows = [
+            {'email': 'jane@example.com', 'password': 'p'},
+            {'email': ' JANE@example.com', 'password': 'p'},
+            {'email': 'john@EXAMPLE.com', 'password': 'p'},
+            {'email': '', 'password': 'p'},
+            {'email': 'joe@example.com', 'password': 'p', 'name': 'joe'},
+        ]
+        self.assertEqual(bulk.bulk_create_email_users(rows, batch_size=2), (2, 3))
+        self.assertEqual(sorted(User.objects.values_list('normalized_email', flat=True)),
+                         ['jane@example.com', 'joe@example.com', 'john@example.com'])
+        self.assertEqual(User.objects.get(normalized_email='joe@example.com').name, 'joe')
+
+    @override_settings(BASE_ACCOUNTS_USERNAME_ALLOCATOR='base_accounts.tests.colliding_username')
+    def test_retries_row_by_row_on_username_collision(self):
+        User.objects.create(username='taken', email='taken@example.com')
+        rows = [{'email': 'user%d@example.com' % i, 'password': 'p'} for i in range(3)]
+        self.assertEqual(bulk.bulk_create_email_users(rows), (3, 0))
+        self.assertEqual(User.objects.filter(normalized_email__startswith='user').count(), 3)
+        self.assertTrue(User.objects.get(normalized_email='user0@example.com').check_password('p'))
+
+    def test_prehashed(self):
+        bulk.bulk_create_email_users([{'email': 'jane@example.com', 'password': make_password('p')}], prehashed=True)
+        self.assertTrue(User.objects.get(normalized_email='jane@example.com').check_password('p'))
+
+    @override_settings(BASE_ACCOUNTS_EMAIL_FILTER=True, BASE_ACCOUNTS_EMAIL_FILTER_TRUSTED=True)
+    def test_imported_users_can_log_in(self):
+        email_filter.rebuild()
+        self.addCleanup(setattr, email_filter, '_filter', None)
+        bulk.bulk_create_email_users([{'email': 'imp@example.com', 'password': 'p'}])
+        self.assertIsNotNone(authenticate(email='imp@example.com', password='p'))
+
+
+class PurgeUnconfirmedTests(TestCase):
+
+    def setUp(self):
+        self.cutoff = now()
+        for i in range(3):
+            create_email_user('user%d@example.com' % i, 'secret', date_joined=self.cutoff - timedelta(days=1))
+        create_email_user('new@example.com', 'secret')
+
+    def confirm_during_purge(self, email):
+        """Confirm ``email`` after its batch has been read, before it is purged"""
+        chunked_queryset = bulk.chunked_queryset
+
+        def chunks(*args, **kwargs):
+            for chunk in chunked_queryset(*args, **kwargs):
+                User.objects.filter(email=email).update(confirmed=now())
+                yield chunk
+        bulk.chunked_queryset = chunks
+        self.addCleanup(setattr, bulk, 'chunked_queryset', chunked_queryset)
+
+    def test_delete(self):
+        self.confirm_during_purge('user1@example.com')
+        self.assertEqual(bulk.purge_unconfirmed_users(self.cutoff, batch_size=2), 2)
+        self.assertEqual(set(User.objects.values_list('email', flat=True)),
+                         set(['user1@example.com', 'new@example.com']))
+
+    def test_deactivate(self):
+        self.confirm_during_purge('user1@example.com')
+        self.assertEqual(bulk.purge_unconfirmed_users(self.cutoff, batch_size=2, deactivate=True), 2)
+        self.assertEqual(set(User.objects.filter(is_active=True).values_list('email', flat=True)),
+                         set(['user1@example.com', 'new@example.com']))
+
+    def test_dry_run(self):
+        self.assertEqual(bulk.purge_unconfirmed_users(self.cutoff, dry_run=True), 3)
+        self.assertEqual(User.objects.count(), 4)
+
+
+class UserAdmin(ExportUsersMixin, admin.ModelAdmin):
+    pass
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = create_email_user('jose@example.com', 'secret', name=u'jos\xe9')
+        self.admin = UserAdmin(User, admin.site)
+
+    def export_view(self, user):
+        request = RequestFactory().get('/admin/base_accounts/user/export/')
+        request.user = user
+        return self.admin.export_view(request)
+
+    def test_csv_non_ascii(self):
+        data = b''.join(bulk.export_users(fields=('email', 'name')))
+        self.assertEqual(data.decode('utf-8').splitlines()[1], u'jose@example.com,jos\xe9')
+
+    def test_not_in_urlconf(self):
+        self.assertEqual(self.client.get('/export/').status_code, 404)
+
+    def test_requires_change_permission(self):
+        self.user.is_staff = True
+        self.assertRaises(PermissionDenied, self.export_view, self.user)
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        response = self.export_view(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(u'jos\xe9'.encode('utf-8'), b''.join(response.streaming_content))
+
+
+@override_settings(BASE_ACCOUNTS_EMAIL_FILTER=True)
+class EmailFilterTests(TransactionTestCase):
+
+    def setUp(self):
+        create_email_user('john@example.com', 'secret')
+        email_filter._filter = None
+
+    def tearDown(self):
+        email_filter._filter = None
+
+    def test_unknown_until_built(self):
+        with email_filter._build_lock:
+            self.assertIsNone(email_filter.might_contain('john@example.com'))
+            thread = email_filter._thread
+        thread.join()
+        self.assertTrue(email_filter.might_contain('john@example.com'))
+        self.assertFalse(email_filter.might_contain('jane@example.com'))
+
+    def test_single_build(self):
+        with email_filter._build_lock:  # Hold the build until every caller has asked
+            answers = []
+            callers = [threading.Thread(target=lambda: answers.append(email_filter.might_contain('john@example.com')))
+                       for i in range(10)]
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join()
+            builders = [t for t in threading.enumerate() if t.name == 'base_accounts-email-filter']
+        self.assertEqual(answers, [None] * 10)
+        self.assertEqual(len(builders), 1)
+        builders[0].join()
+        self.assertTrue(email_filter.might_contain('john@example.com'))
+
+    def test_keeps_emails_added_while_building(self):
+        chunked_queryset = email_filter.chunked_queryset
+
+        def chunks(*args, **kwargs):
+            email_filter.add('jane@example.com')
+            return chunked_queryset(*args, **kwargs)
+        email_filter.chunked_queryset = chunks
+        self.addCleanup(setattr, email_filter, 'chunked_queryset', chunked_queryset)
+        email_filter.rebuild()
+        self.assertTrue(email_filter.might_contain('jane@example.com'))
+
+
+class FakeSession(dict):
+    """Session stand-in for driving the session index without a request"""
+
+    def __init__(self, session_key):
+        super(FakeSession, self).__init__()
+        self.session_key = session_key
+
+
+class FakeRequest(object):
+
+    def __init__(self, session_key):
+        self.session = FakeSession(session_key)
+
+
+@override_settings(BASE_ACCOUNTS_SESSION_INDEX=True)
+class SessionIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret')
+        self.clients = [self.client_class() for i in range(3)]
+        for client in self.clients:
+            client.login(email='john@example.com', password='secret')
+
+    def tearDown(self):
+        session_index._cache().clear()
+
+    def test_tracks_logins_and_logouts(self):
+        self.assertEqual(session_index.get_session_keys(self.user),
+                         [client.session.session_key for client in self.clients])
+        logged_out = self.clients.pop()
+        logged_out.get(reverse('logout'))
+        self.assertEqual(session_index.get_session_keys(self.user),
+                         [client.session.session_key for client in self.clients])
+
+    def test_revoke_keeps_current_session(self):
+        keep = self.clients[0].session.session_key
+        self.assertEqual(session_index.revoke_sessions(self.user, keep=keep), 2)
+        self.assertEqual(session_index.get_session_keys(self.user), [keep])
+        self.assertNotIn('_auth_user_id', self.clients[1].session)
+        self.assertIn('_auth_user_id', self.clients[0].session)
+
+    @override_settings(BASE_ACCOUNTS_SESSION_INDEX_SIZE=2)
+    def test_size(self):
+        self.assertEqual(session_index.get_session_keys(self.user),
+                         [client.session.session_key for client in self.clients[1:]])
+
+
+@override_settings(BASE_ACCOUNTS_SESSION_INDEX=True)
+class ConcurrentSessionIndexTests(TestCase):
+    """Concurrent logins and logouts of one user never lose index entries"""
+    threads = 20
+
+    def setUp(self):
+        self.user = create_email_user('john@example.com', 'secret')
+
+    def tearDown(self):
+        session_index._cache().clear()
+
+    def run_concurrently(self, target, requests):
+        start = threading.Event()
+
+        def run(request):
+            start.wait()
+            target(None, request=request, user=self.user)
+
+        workers = [threading.Thread(target=run, args=(request,)) for request in requests]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+
+    def test_logins_and_logouts(self):
+        requests = [FakeRequest('session%d' % i) for i in range(self.threads)]
+        self.run_concurrently(session_index.track_login, requests)
+        self.assertEqual(sorted(session_index.get_session_keys(self.user)),
+                         sorted(request.session.session_key for request in requests))
+        self.run_concurrently(session_index.track_logout, requests[::2])
+        self.assertEqual(sorted(session_index.get_session_keys(self.user)),
+                         sorted(request.session.session_key for request in requests[1::2]))
+
+
+class ConcurrentSignupTests(TransactionTestCase):
+    """Concurrent ``create_email_user`` calls against one database all succeed"""
+    threads = 20
+
+    def signup_concurrently(self):
+        errors = []
+        start = threading.Event()
+
+        def signup(i):
+            start.wait()
+            try:
+                create_email_user('user%d@example.com' % i, 'secret')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=signup, args=(i,)) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+        return errors
+
+    def test_random_usernames(self):
+        self.assertEqual(self.signup_concurrently(), [])
+        usernames = set(User.objects.values_list('username', flat=True))
+        self.assertEqual(len(usernames), self.threads)
+
+    @override_settings(BASE_ACCOUNTS_USERNAME_ALLOCATOR='base_accounts.tests.colliding_username')
+    def test_retries_on_username_collision(self):
+        User.objects.create(username='taken', email='taken@example.com')
+        self.assertEqual(self.signup_concurrently(), [])
+        self.assertEqual(User.objects.count(), self.threads + 1)
+
@@ -0,0 +1,135 @@
+"""
+Throttling of failed logins.
+
+Failures are counted per normalized email and per client IP with sliding
+window counters, approximated from the current and previous fixed windows.
+Counters live in a Django cache when ``BASE_ACCOUNTS_LOGIN_THROTTLE_CACHE``
+is set, or in a bounded in-process LRU otherwise. ``LoginForm`` checks them
+before authenticating, so a throttled attempt never computes a hash.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from base_accounts.utils import get_cache, normalize_email
+
+
+class LocalCounterStore(object):
+    """
+    Expiring counters held in process memory, evicting the least recently
+    used ones beyond ``max_entries``
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        result = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is not None and item[1] > now:
+                    result[key] = item[0]
+        return result
+
+    def incr(self, key, timeout):
+        now = time.time()
+        with self._lock:
+            value, expires = self._data.pop(key, (0, 0))
+            if expires <= now:
+                value, expires = 0, now + timeout
+            self._data[key] = (value + 1, expires)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class CacheCounterStore(object):
+    """
+    Expiring counters held in a Django cache
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def incr(self, key, timeout):
+        if self.cache.add(key, 1, timeout):
+            return
+        try:
+            self.cache.incr(key)
+        except ValueError:  # Expired between add() and incr()
+            self.cache.set(key, 1, timeout)
+
+
+_local_store = None
+_local_lock = threading.Lock()
+
+
+def get_store():
+    global _local_store
+    alias = getattr(settings, 'BASE_ACCOUNTS_LOGIN_THROTTLE_CACHE', None)
+    if alias:
+        return CacheCounterStore(get_cache(alias))
+    with _local_lock:
+        if _local_store is None:
+            _local_store = LocalCounterStore(getattr(settings, 'BASE_ACCOUNTS_LOGIN_THROTTLE_LOCAL_SIZE', 10000))
+    return _local_store
+
+
+def login_keys(request, email):
+    """
+    Return the identities a login attempt is counted against
+    """
+    keys = [('email', normalize_email(email))]
+    if request is not None and request.META.get('REMOTE_ADDR'):
+        keys.append(('ip', request.META['REMOTE_ADDR']))
+    return keys
+
+
+def _window_keys(scope, ident, period, now):
+    digest = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+    index = int(now // period)
+    return ('base_accounts:throttle:%s:%s:%d' % (scope, digest, index),
+            'base_accounts:throttle:%s:%s:%d' % (scope, digest, index - 1))
+
+
+def is_throttled(keys):
+    """
+    Return whether any of ``keys`` has reached the failure limit set in
+    ``BASE_ACCOUNTS_LOGIN_THROTTLE`` within the sliding window
+    """
+    rate = getattr(settings, 'BASE_ACCOUNTS_LOGIN_THROTTLE', None)
+    if rate is None:
+        return False
+    limit, period = rate
+    now = time.time()
+    weight = 1 - (now % period) / float(period)  # Share of previous window still in range
+    windows = [_window_keys(scope, ident, period, now) for scope, ident in keys]
+    counts = get_store().get_many([key for pair in windows for key in pair])
+    for current, previous in windows:
+        if counts.get(current, 0) + counts.get(previous, 0) * weight >= limit:
+            return True
+    return False
+
+
+def record_failure(keys):
+    """
+    Count a failed login against every one of ``keys``
+    """
+    rate = getattr(settings, 'BASE_ACCOUNTS_LOGIN_THROTTLE', None)
+    if rate is None:
+        return
+    limit, period = rate
+    now = time.time()
+    store = get_store()
+    for scope, ident in keys:
+        current, previous = _window_keys(scope, ident, period, now)
+        store.incr(current, period * 2)  # Still needed as previous window
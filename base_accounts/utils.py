@@ -1,4 +1,26 @@
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.crypto import get_random_string, salted_hmac
+
+from base_accounts import hashing
+from base_accounts.instrumentation import Timer
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:  # Django < 1.7
+    from django.utils.module_loading import import_by_path as import_string
+
+try:
+    from django.core.cache import caches
+
+    def get_cache(alias):
+        return caches[alias]
+except ImportError:  # Django < 1.7
+    from django.core.cache import get_cache
 
 
 class UserAlreadyExists(Exception):
@@ -8,6 +30,116 @@ class UserAlreadyExists(Exception):
     pass
 
 
+class UsernameUnavailable(Exception):
+    """
+    No free username could be allocated within the allowed attempts
+    """
+    pass
+
+
+class LazyUserModel(object):
+    """
+    Class attribute resolving ``get_user_model()`` on first access instead
+    of when the class is defined, so importing does not need the app
+    registry to be ready.
+    """
+
+    def __init__(self):
+        self.model = None
+
+    def __get__(self, instance, owner):
+        if self.model is None:
+            self.model = get_user_model()
+        return self.model
+
+
+class LazySetting(object):
+    """
+    Class attribute reading ``settings.<name>`` on access, falling back to
+    the ``fallback`` setting or to ``default``. Instances may still override
+    it by assignment.
+    """
+
+    def __init__(self, name, default=None, fallback=None):
+        self.name = name
+        self.default = default
+        self.fallback = fallback
+
+    def __get__(self, instance, owner):
+        if hasattr(settings, self.name):
+            return getattr(settings, self.name)
+        if self.fallback:
+            return getattr(settings, self.fallback)
+        return self.default
+
+
+def normalize_email(email):
+    """
+    Return the canonical (stripped and lowercased) form of an email address,
+    as stored in ``BaseUser.normalized_email``.
+    """
+    if not email:
+        return email
+    return email.strip().lower()
+
+
+_unnormalized = {'exists': None, 'checked': 0}
+
+
+def unnormalized_emails_exist():
+    """
+    Whether some users with an email have no ``normalized_email`` yet, i.e.
+    ``normalize_emails`` has not backfilled them. Checked at most once a
+    minute, and never again once false, as saved users always get one.
+    """
+    if _unnormalized['exists'] is False:
+        return False
+    if _unnormalized['exists'] is None or time.time() - _unnormalized['checked'] > 60:
+        _unnormalized['exists'] = get_user_model()._default_manager.filter(
+            normalized_email=None).exclude(email='').exists()
+        _unnormalized['checked'] = time.time()
+    return _unnormalized['exists']
+
+
+def email_lookup(email):
+    """
+    Return a ``Q`` matching users by normalized ``email``, falling back to
+    a case-insensitive match on users not backfilled yet
+    """
+    lookup = Q(normalized_email=email)
+    if unnormalized_emails_exist():
+        lookup |= Q(normalized_email=None, email__iexact=email)
+    return lookup
+
+
+def email_digest(email):
+    """
+    Return a keyed hash of a normalized email, to tie signed data to an
+    address without revealing it
+    """
+    return salted_hmac('base_accounts.email_digest', email or '').hexdigest()
+
+
+def chunked_queryset(queryset, chunk_size=1000):
+    """
+    Walk ``queryset`` in primary key order using keyset pagination, yielding
+    lists of at most ``chunk_size`` items. Works with model instances and
+    with ``values_list`` querysets whose first field is the primary key.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        last_pk = last.pk if hasattr(last, 'pk') else last[0]
+
+
 def unique_username(email, counter):
     """
     Create a new username (30 chars max) by joining the left user part
@@ -18,18 +150,55 @@ def unique_username(email, counter):
     return username[:30]
 
 
-def create_email_user(email, password, user_model=get_user_model(), **extrafields):
+def random_username(email, attempt):
+    """
+    Create a new username (30 chars max) by joining the left user part
+    of an email address and a random suffix. Needs no database access, so
+    concurrent signups never compute the same candidate from shared state.
+    """
+    suffix = get_random_string(6, 'abcdefghijklmnopqrstuvwxyz0123456789')
+    username = '%s%s' % (email.split('@', 1)[0][:30 - len(suffix)], suffix)
+    return username[:30]
+
+
+def get_username_allocator():
+    """
+    Return the callable set in ``BASE_ACCOUNTS_USERNAME_ALLOCATOR``, which
+    takes an email and an attempt number and returns a candidate username.
+    """
+    path = getattr(settings, 'BASE_ACCOUNTS_USERNAME_ALLOCATOR', 'base_accounts.utils.random_username')
+    return import_string(path)
+
+
+def create_email_user(email, password, user_model=None, **extrafields):
     """
     Generate a unique username and create a new instance of ``user_model``
-    with email, password and any other extra fields
-    """
-    try:
-        user_model.objects.get(email__iexact=email.lower())
-    except user_model.DoesNotExist:
-        base_user = get_user_model()  # Make sure to count User, not inheriting models
-        obj_count = base_user.objects.count()
-        username = unique_username(email, obj_count)
-        user = user_model.objects.create_user(username, email, password, **extrafields)
-        return user
-    else:
-        raise UserAlreadyExists
+    with email, password and any other extra fields. Unique indexes decide
+    collisions: a taken email raises ``UserAlreadyExists`` and a clashing
+    username or slug is retried up to ``BASE_ACCOUNTS_USERNAME_MAX_ATTEMPTS``
+    times.
+    """
+    timer = Timer('create_email_user')
+    base_user = get_user_model()  # Make sure to check User, not inheriting models
+    user_model = user_model or base_user
+    allocate = get_username_allocator()
+    max_attempts = getattr(settings, 'BASE_ACCOUNTS_USERNAME_MAX_ATTEMPTS', 5)
+    password = hashing.make_password(password)  # Hash once for every attempt
+    timer.phase('hash')
+    email = user_model.objects.normalize_email(email)
+    if unnormalized_emails_exist() and base_user.objects.filter(normalized_email=None, email__iexact=email).exists():
+        raise UserAlreadyExists  # The unique index cannot see emails not backfilled yet
+    for attempt in range(max_attempts):
+        user = user_model(username=allocate(email, attempt), email=email, password=password, **extrafields)
+        try:
+            with transaction.atomic():
+                user.save()
+            timer.phase('insert', 'created')
+            return user
+        except IntegrityError:
+            if base_user.objects.filter(email_lookup(normalize_email(email))).exists():
+                timer.phase('insert', 'exists')
+                raise UserAlreadyExists
+            if not base_user.objects.filter(Q(username=user.username) | Q(slug=user.slug)).exists():
+                raise
+    raise UsernameUnavailable
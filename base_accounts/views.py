@@ -3,14 +3,20 @@
 from django.views.generic import View, FormView
 from django.contrib.auth import login, logout
 from django.shortcuts import redirect, get_object_or_404
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext as _, ugettext_lazy as _lazy
 from django.utils.timezone import now
 from django.conf import settings
 from django.http import Http404
 from django.core import signing
+from django.utils.crypto import constant_time_compare
 from django.core.urlresolvers import reverse_lazy
 from django.contrib.auth import get_user_model
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.db import IntegrityError, transaction
 
+from base_accounts import auth_cache, db, mail, session_index
+from base_accounts.hashing import HashingUnavailable
+from base_accounts.utils import LazySetting, UserAlreadyExists, email_digest
 from base_accounts.forms import SignupForm, LoginForm, UpdateEmailForm, UpdatePasswordForm
 
 
@@ -74,8 +80,8 @@ class NextRedirectMixin(object):
 class SignupFormView(SuccessMessageMixin, NextRedirectMixin, FormView):
     form_class = SignupForm
     template_name = 'base_accounts/signup.html'
-    success_url = getattr(settings, 'BASE_ACCOUNTS_SIGNUP_REDIRECT_URL', settings.LOGIN_REDIRECT_URL)
-    success_message = _("Welcome!")
+    success_url = LazySetting('BASE_ACCOUNTS_SIGNUP_REDIRECT_URL', fallback='LOGIN_REDIRECT_URL')
+    success_message = _lazy("Welcome!")
 
     def get_form_kwargs(self):
         """Form uses request to signup"""
@@ -84,15 +90,22 @@ class SignupFormView(SuccessMessageMixin, NextRedirectMixin, FormView):
         return kwargs
 
     def form_valid(self, form):
-        form.save()
+        try:
+            form.save()
+        except HashingUnavailable:
+            form._errors[NON_FIELD_ERRORS] = form.error_class([_("Too many requests, please try again later")])
+            return self.form_invalid(form)
+        except UserAlreadyExists:  # Email taken since the form was cleaned
+            form._errors['email'] = form.error_class([_("Email is already being used by another user")])
+            return self.form_invalid(form)
         return super(SignupFormView, self).form_valid(form)
 
 
 class LoginFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, NextRedirectMixin, FormView):
     form_class = LoginForm
     template_name = 'base_accounts/login.html'
-    success_url = getattr(settings, 'BASE_ACCOUNTS_LOGIN_REDIRECT_URL', settings.LOGIN_REDIRECT_URL)
-    success_message = _("You have logged in")
+    success_url = LazySetting('BASE_ACCOUNTS_LOGIN_REDIRECT_URL', fallback='LOGIN_REDIRECT_URL')
+    success_message = _lazy("You have logged in")
 
     def get_form_kwargs(self):
         """Form uses request to login"""
@@ -100,14 +113,23 @@ class LoginFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, NextRedirect
         kwargs.update({'request': self.request})
         return kwargs
 
+    def form_valid(self, form):
+        """Optionally flag the success message in a cookie, not in message storage"""
+        cookie_name = getattr(settings, 'BASE_ACCOUNTS_LOGIN_MESSAGE_COOKIE', None)
+        if not cookie_name:
+            return super(LoginFormView, self).form_valid(form)
+        response = super(SuccessMessageMixin, self).form_valid(form)
+        response.set_cookie(cookie_name, '1', max_age=60)
+        return response
+
 
 class UpdateEmailFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, FormView):
     """Updates user model with new provided email"""
     form_class = UpdateEmailForm
     template_name = 'base_accounts/update_email.html'
-    success_url = getattr(settings, 'BASE_ACCOUNTS_UPDATE_EMAIL_REDIRECT_URL', reverse_lazy('settings_update_email'))
-    error_url = getattr(settings, 'BASE_ACCOUNTS_UPDATE_EMAIL_ERROR_REDIRECT_URL', reverse_lazy('settings_update_email'))
-    success_message = _('You have updated your email successfully')
+    success_url = LazySetting('BASE_ACCOUNTS_UPDATE_EMAIL_REDIRECT_URL', reverse_lazy('settings_update_email'))
+    error_url = LazySetting('BASE_ACCOUNTS_UPDATE_EMAIL_ERROR_REDIRECT_URL', reverse_lazy('settings_update_email'))
+    success_message = _lazy('You have updated your email successfully')
 
     def get_form_kwargs(self):
         """Form uses request to fetch current user"""
@@ -118,9 +140,20 @@ class UpdateEmailFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, FormVi
     def form_valid(self, form):
         new_email = form.cleaned_data.get('email')
         if self.request.user.email != new_email:
+            auth_cache.invalidate(self.request.user.normalized_email)
             self.request.user.email = new_email
             self.request.user.confirmed = None
-            self.request.user.save()
+            update_fields = ['email', 'confirmed']
+            if mail.enabled():
+                self.request.user.confirmation_requested = now()
+                update_fields.append('confirmation_requested')
+            try:
+                with transaction.atomic():
+                    self.request.user.save(update_fields=update_fields)
+            except IntegrityError:  # Email taken since the form was cleaned
+                form._errors['email'] = form.error_class([_("Email is already being used by another user")])
+                return self.form_invalid(form)
+            session_index.revoke_sessions(self.request.user, keep=self.request.session.session_key)
         return super(UpdateEmailFormView, self).form_valid(form)
 
 
@@ -128,9 +161,9 @@ class UpdatePasswordFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, For
     """Updates user model with new provided password"""
     form_class = UpdatePasswordForm
     template_name = 'base_accounts/update_password.html'
-    success_url = getattr(settings, 'BASE_ACCOUNTS_UPDATE_PASSWORD_REDIRECT_URL', reverse_lazy('settings_update_password'))
-    error_url = getattr(settings, 'BASE_ACCOUNTS_UPDATE_PASSWORD_ERROR_REDIRECT_URL', reverse_lazy('settings_update_password'))
-    success_message = _('You have updated your password successfully')
+    success_url = LazySetting('BASE_ACCOUNTS_UPDATE_PASSWORD_REDIRECT_URL', reverse_lazy('settings_update_password'))
+    error_url = LazySetting('BASE_ACCOUNTS_UPDATE_PASSWORD_ERROR_REDIRECT_URL', reverse_lazy('settings_update_password'))
+    success_message = _lazy('You have updated your password successfully')
 
     def get_form_kwargs(self):
         """Form uses request to fetch current user"""
@@ -141,19 +174,20 @@ class UpdatePasswordFormView(SuccessMessageMixin, ErrorMessageRedirectMixin, For
     def form_valid(self, form):
         """Use model method to update new password"""
         self.request.user.set_password(form.cleaned_data['password1'])
-        self.request.user.save()
+        self.request.user.save(update_fields=['password'])
         # Django >= 1.7 requires this call to stay logged in.
         # More info: https://docs.djangoproject.com/en/1.7/topics/auth/default/#session-invalidation-on-password-change
         from django.contrib import auth
         if hasattr(auth, 'update_session_auth_hash'):
             auth.update_session_auth_hash(self.request, self.request.user)
+        session_index.revoke_sessions(self.request.user, keep=self.request.session.session_key)
         return super(UpdatePasswordFormView, self).form_valid(form)
 
 
 class PostLoginRedirectView(SuccessMessageMixin, View):
     """Used by social login flows (e.g. OAuth)"""
-    success_url = getattr(settings, 'BASE_ACCOUNTS_POST_LOGIN_REDIRECT_URL', settings.LOGIN_REDIRECT_URL)
-    success_message = _("You have logged in")
+    success_url = LazySetting('BASE_ACCOUNTS_POST_LOGIN_REDIRECT_URL', fallback='LOGIN_REDIRECT_URL')
+    success_message = _lazy("You have logged in")
 
     def dispatch(self, request, *args, **kwargs):
         """Override post-login url if provided"""
@@ -165,7 +199,7 @@ class PostLoginRedirectView(SuccessMessageMixin, View):
 
 class LogoutView(View):
     """Updates User.first_login field before logout"""
-    success_url = getattr(settings, 'BASE_ACCOUNTS_LOGOUT_REDIRECT_URL', '/')
+    success_url = LazySetting('BASE_ACCOUNTS_LOGOUT_REDIRECT_URL', '/')
 
     def dispatch(self, request, *args, **kwargs):
         list(messages.get_messages(request))  # Get rid of messages
@@ -181,22 +215,31 @@ def confirm_email_address(request, token):
     """Confirms user's email address"""
     success_url = getattr(settings, 'BASE_ACCOUNTS_CONFIRM_EMAIL_REDIRECT_URL', '/')
     try:
-        pk = signing.loads(token, max_age=3600 * 48, salt='resend_email_confirmation')
+        payload = signing.loads(token, max_age=3600 * 48, salt='resend_email_confirmation')
     except signing.BadSignature:
         raise Http404
-    user = get_object_or_404(get_user_model(), pk=pk)
 
-    if user.confirmed:
+    # Check the token against the user's current email. Tokens signed before
+    # the email digest was included only hold the pk.
+    user_model = get_user_model()
+    pk, digest = payload if isinstance(payload, (list, tuple)) else (payload, None)
+    if request.user.is_authenticated() and request.user.pk == pk:
+        user = request.user
+    else:
+        user = get_object_or_404(user_model, pk=pk)
+    if digest is not None and not constant_time_compare(digest, email_digest(user.normalized_email)):
         raise Http404
 
-    user.confirmed = now()
-    user.save()
+    # Confirm with a conditional UPDATE, which also rejects tokens already
+    # used or whose email changed since it was read
+    users = user_model.objects.filter(pk=pk, normalized_email=user.normalized_email, confirmed__isnull=True)
+    if not users.update(confirmed=now()):
+        raise Http404
+    db.mark_write()
 
-    if request.user != user:
+    if user is not request.user:
         logout(request)
-
-    if not request.user.is_authenticated():
-        user.backend = 'django.contrib.auth.backends.ModelBackend'
+        user.backend = getattr(settings, 'BASE_ACCOUNTS_LOGIN_BACKEND', 'django.contrib.auth.backends.ModelBackend')
         login(request, user)
 
     if user.is_active:
@@ -205,3 +248,4 @@ def confirm_email_address(request, token):
     else:
         messages.success(request, _('Please confirm your email address'))
         return redirect('password_reset_recover')
+
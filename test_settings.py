@@ -0,0 +1,59 @@
+"""
+Minimal settings to run the test suite::
+
+    django-admin.py test base_accounts --settings=test_settings
+"""
+import os
+import tempfile
+
+SECRET_KEY = 'base_accounts-tests'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'base_accounts_default.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'base_accounts_test_default.sqlite3')},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'base_accounts_replica.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'base_accounts_test_replica.sqlite3')},
+    },
+}
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'base_accounts',
+)
+
+# Create tables straight from models, the test user model has no migrations
+MIGRATION_MODULES = {
+    'auth': 'no_migrations.migrations',
+    'contenttypes': 'no_migrations.migrations',
+    'sessions': 'no_migrations.migrations',
+}
+
+MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+
+ROOT_URLCONF = 'base_accounts.urls'
+
+AUTH_USER_MODEL = 'base_accounts.User'
+AUTHENTICATION_BACKENDS = (
+    'base_accounts.auth_backend.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+)
+PASSWORD_HASHERS = ('django.contrib.auth.hashers.MD5PasswordHasher',)
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+LOGIN_REDIRECT_URL = '/'